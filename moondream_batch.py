@@ -9,17 +9,134 @@ responses. Start Moondream Station separately before using this helper.
 from __future__ import annotations
 
 import argparse
-import base64
+import hashlib
 import json
-import mimetypes
+import os
 import sys
+import threading
+from binascii import b2a_base64
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Iterable, List
+from typing import Dict, Iterable, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    # SIMD-accelerated drop-in for the stdlib encoder; optional.
+    import pybase64 as base64  # type: ignore
+except ImportError:
+    import base64
+
+try:
+    # Faster JSON for the multi-MB data-URL request bodies; optional.
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    # Optional HTTP/2 client (needs the h2 extra); requests stays the default.
+    import httpx  # type: ignore
+except ImportError:
+    httpx = None
 
 DEFAULT_ENDPOINT = "http://127.0.0.1:2020"
-IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".heic"}
+EXT_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+}
+IMAGE_EXTS = set(EXT_MIME)
+# Read size for streamed base64; a multiple of 3 so chunks encode without padding.
+B64_CHUNK_SIZE = 48 * 1024
+DEFAULT_RETRIES = 3
+# Below this size a single read + encode call is cheaper than the streaming loop.
+SMALL_IMAGE_BYTES = 64 * 1024
+
+
+def dumps_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads_json(data: bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def make_retry(retries: int) -> Retry:
+    """Retry transient station errors inside the pool, without re-encoding the image."""
+    return Retry(
+        total=retries,
+        # Never re-send an inference request after a read timeout: the station may still be
+        # working on it. Only connect errors and the statuses below are retried.
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST"]),
+        # Hand the last bad response back so raise_for_status reports it as before.
+        raise_on_status=False,
+    )
+
+
+def make_session(retries: int = DEFAULT_RETRIES) -> requests.Session:
+    """Build a keep-alive session so consecutive images reuse one connection."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=make_retry(retries))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def make_http2_client(retries: int = DEFAULT_RETRIES):
+    """Build an HTTP/2 client, or return None when httpx/h2 are not installed.
+
+    httpx only retries failed connects, not 5xx responses.
+    """
+    if httpx is None:
+        return None
+    try:
+        # With an explicit transport, httpx ignores the Client's http2/limits arguments,
+        # so the pool cap has to be set on the transport itself.
+        return httpx.Client(
+            transport=httpx.HTTPTransport(
+                http2=True, retries=retries, limits=httpx.Limits(max_connections=16)
+            ),
+        )
+    except ImportError:
+        return None
+
+
+_SESSION = make_session()
+_ENCODE_BUFFERS = threading.local()
+_RESULTS_LOCK = threading.Lock()
+# Errors raised by whichever client _SESSION ends up being.
+HTTP_ERRORS = (requests.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+
+def _scan_images(root: str) -> Iterator[os.DirEntry]:
+    """Yield image entries under root, filtering on the name before any stat call.
+
+    Like Path.rglob, directory symlinks are not followed.
+    """
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _scan_images(entry.path)
+                    continue
+                dot = entry.name.rfind(".")
+                if dot > 0 and entry.name[dot:].lower() in IMAGE_EXTS and entry.is_file():
+                    yield entry
+    except PermissionError:
+        return
 
 
 def find_images(inputs: Iterable[str]) -> List[Path]:
@@ -32,19 +149,21 @@ def find_images(inputs: Iterable[str]) -> List[Path]:
             continue
 
         if path.is_file() and path.suffix.lower() in IMAGE_EXTS:
-            resolved = path.resolve()
+            resolved = os.fspath(path.resolve())
             if resolved not in seen:
-                files.append(resolved)
+                files.append(Path(resolved))
                 seen.add(resolved)
             continue
 
         if path.is_dir():
-            for candidate in sorted(path.rglob("*")):
-                if candidate.is_file() and candidate.suffix.lower() in IMAGE_EXTS:
-                    resolved = candidate.resolve()
-                    if resolved not in seen:
-                        files.append(resolved)
-                        seen.add(resolved)
+            # Resolve the root once; only symlinked files below it need resolving again.
+            root = os.fspath(path.resolve())
+            entries = sorted(_scan_images(root), key=lambda e: e.path.split(os.sep))
+            for entry in entries:
+                resolved = os.path.realpath(entry.path) if entry.is_symlink() else entry.path
+                if resolved not in seen:
+                    files.append(Path(resolved))
+                    seen.add(resolved)
             continue
 
         print(f"[warn] not an image: {path}")
@@ -52,12 +171,59 @@ def find_images(inputs: Iterable[str]) -> List[Path]:
     return files
 
 
+def b64encode_into(path: Path, out: bytearray, pos: int = 0) -> int:
+    """Stream-encode a file into out starting at pos; returns the end offset.
+
+    out grows if the file turns out larger than expected.
+    """
+    with path.open("rb") as f:
+        while chunk := f.read(B64_CHUNK_SIZE):
+            encoded = base64.b64encode(chunk)
+            out[pos : pos + len(encoded)] = encoded
+            pos += len(encoded)
+    return pos
+
+
+def guess_mime(path: Path) -> str:
+    return EXT_MIME.get(path.suffix.lower(), "image/png")
+
+
+def b64encode_small(data: bytes) -> str:
+    if hasattr(base64, "b64encode_as_string"):  # pybase64
+        return base64.b64encode_as_string(data)
+    return b2a_base64(data, newline=False).decode("ascii")
+
+
 def encode_image(path: Path) -> str:
-    mime, _ = mimetypes.guess_type(path.name)
-    if not mime:
-        mime = "image/png"
-    data = base64.b64encode(path.read_bytes()).decode("ascii")
-    return f"data:{mime};base64,{data}"
+    size = os.path.getsize(path)
+    if size < SMALL_IMAGE_BYTES:
+        return "".join(("data:", guess_mime(path), ";base64,", b64encode_small(path.read_bytes())))
+
+    # One buffer per thread, grown to the largest image seen so far. The data-URL prefix and
+    # the base64 body are written into it in place, so the returned str is the only
+    # per-image allocation.
+    buf = getattr(_ENCODE_BUFFERS, "buf", None)
+    if buf is None:
+        buf = _ENCODE_BUFFERS.buf = bytearray()
+    prefix = "".join(("data:", guess_mime(path), ";base64,")).encode("ascii")
+    needed = len(prefix) + ((size + 2) // 3) * 4
+    if len(buf) < needed:
+        buf.extend(bytes(needed - len(buf)))
+    buf[: len(prefix)] = prefix
+    end = b64encode_into(path, buf, len(prefix))
+    return str(memoryview(buf)[:end], "ascii")
+
+
+def station_supports_multipart(endpoint: str, timeout: float) -> bool:
+    """Ask the station whether it accepts raw multipart image uploads."""
+    url = endpoint.rstrip("/") + "/v1/capabilities"
+    try:
+        response = _SESSION.get(url, timeout=timeout)
+        response.raise_for_status()
+        caps = response.json()
+    except (*HTTP_ERRORS, ValueError):
+        return False
+    return isinstance(caps, dict) and bool(caps.get("multipart"))
 
 
 def call_station(
@@ -66,16 +232,35 @@ def call_station(
     image: Path,
     payload: Dict[str, str],
     timeout: float,
+    raw_upload: bool = False,
 ) -> Dict:
-    body: Dict[str, str] = {"stream": False, **payload}
-    body["image_url"] = encode_image(image)
     url = endpoint.rstrip("/") + f"/v1/{function}"
 
     try:
-        response = requests.post(url, json=body, timeout=timeout)
+        if raw_upload:
+            # Send the file bytes as-is; skips base64 and its 4/3 body inflation.
+            form: Dict[str, str] = {"stream": "false", **payload}
+            with image.open("rb") as f:
+                response = _SESSION.post(
+                    url,
+                    data=form,
+                    files={"image": (image.name, f, guess_mime(image))},
+                    timeout=timeout,
+                )
+        else:
+            body: Dict[str, str] = {"stream": False, **payload}
+            body["image_url"] = encode_image(image)
+            # httpx takes a raw bytes body as content= (data= is deprecated for bytes there).
+            body_arg = "data" if isinstance(_SESSION, requests.Session) else "content"
+            response = _SESSION.post(
+                url,
+                headers={"Content-Type": "application/json"},
+                timeout=timeout,
+                **{body_arg: dumps_json(body)},
+            )
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as exc:
+        return loads_json(response.content)
+    except HTTP_ERRORS as exc:
         raise RuntimeError(f"request failed for {image.name}: {exc}") from exc
     except json.JSONDecodeError as exc:
         raise RuntimeError(
@@ -83,6 +268,44 @@ def call_station(
         ) from exc
 
 
+def file_digest(path: Path) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def call_station_deduped(
+    results: Dict[bytes, Future],
+    endpoint: str,
+    function: str,
+    image: Path,
+    payload: Dict[str, str],
+    timeout: float,
+    raw_upload: bool = False,
+) -> Dict:
+    """call_station, but images with identical bytes share a single request.
+
+    The first image with a given digest makes the call; later ones wait on its result.
+    """
+    digest = file_digest(image)
+    with _RESULTS_LOCK:
+        shared: Optional[Future] = results.get(digest)
+        if shared is None:
+            owner = results[digest] = Future()
+    if shared is not None:
+        return shared.result()
+
+    try:
+        result = call_station(endpoint, function, image, payload, timeout, raw_upload)
+    except BaseException as exc:
+        owner.set_exception(exc)
+        raise
+    owner.set_result(result)
+    return result
+
+
 def parse_params(pairs: Iterable[str]) -> Dict[str, str]:
     params: Dict[str, str] = {}
     for pair in pairs:
@@ -120,6 +343,8 @@ def pick_primary_text(result: Dict) -> str:
 
 
 def run() -> int:
+    global _SESSION
+
     parser = argparse.ArgumentParser(description="Batch Moondream Station helper")
     parser.add_argument(
         "inputs",
@@ -163,6 +388,30 @@ def run() -> int:
         default=120.0,
         help="HTTP timeout in seconds for each request",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of images to process concurrently (default: min(8, images))",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Retries with backoff for connection errors and 502/503/504 responses",
+    )
+    parser.add_argument(
+        "--raw-upload",
+        action="store_true",
+        help="Upload raw image bytes as multipart/form-data if the station supports it",
+    )
+    parser.add_argument(
+        "--http2",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Talk to an https:// station over HTTP/2 via httpx (requires httpx[http2]); "
+        "plain-http endpoints stay on HTTP/1.1",
+    )
     args = parser.parse_args()
 
     images = find_images(args.inputs)
@@ -186,33 +435,75 @@ def run() -> int:
     if output_dir:
         output_dir.mkdir(parents=True, exist_ok=True)
 
-    for image in images:
-        print(f"\n=== {image} ===")
-        try:
-            result = call_station(
-                args.endpoint, args.function, image, extra, args.timeout
-            )
-        except RuntimeError as exc:
-            print(exc)
-            continue
+    workers = args.workers if args.workers is not None else min(8, len(images))
+    if workers < 1:
+        print("--workers must be at least 1")
+        return 1
 
-        text = pick_primary_text(result)
-        print(text)
-
-        stats = result.get("_stats") or result.get("stats")
-        if stats:
-            token_info = []
-            if "tokens" in stats:
-                token_info.append(f"tokens={stats['tokens']}")
-            if "tokens_per_sec" in stats:
-                token_info.append(f"tok/s={stats['tokens_per_sec']}")
-            if token_info:
-                print("(" + ", ".join(token_info) + ")")
-
-        if output_dir:
-            out_file = output_dir / f"{image.stem}-{args.function}.txt"
-            out_file.write_text(text)
-            print(f"saved → {out_file}")
+    if args.retries < 0:
+        print("--retries must be 0 or more")
+        return 1
+    if args.retries != DEFAULT_RETRIES:
+        _SESSION = make_session(args.retries)
+
+    if args.http2:
+        if not args.endpoint.startswith("https://"):
+            # httpx only negotiates HTTP/2 via TLS ALPN; on plain http it would just be HTTP/1.1.
+            print("[warn] --http2 needs an https:// endpoint; using HTTP/1.1 via requests")
+        else:
+            client = make_http2_client(args.retries)
+            if client is None:
+                print("[warn] httpx[http2] is not installed; falling back to requests")
+            else:
+                _SESSION = client
+
+    raw_upload = False
+    if args.raw_upload:
+        raw_upload = station_supports_multipart(args.endpoint, args.timeout)
+        if not raw_upload:
+            print("[warn] station does not advertise multipart uploads; sending data URLs")
+
+    # Encode + HTTP overlap across images; results are still printed in input order.
+    results: Dict[bytes, Future] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(
+                call_station_deduped,
+                results,
+                args.endpoint,
+                args.function,
+                image,
+                extra,
+                args.timeout,
+                raw_upload,
+            )
+            for image in images
+        ]
+        for image, future in zip(images, futures):
+            print(f"\n=== {image} ===")
+            try:
+                result = future.result()
+            except RuntimeError as exc:
+                print(exc)
+                continue
+
+            text = pick_primary_text(result)
+            print(text)
+
+            stats = result.get("_stats") or result.get("stats")
+            if stats:
+                token_info = []
+                if "tokens" in stats:
+                    token_info.append(f"tokens={stats['tokens']}")
+                if "tokens_per_sec" in stats:
+                    token_info.append(f"tok/s={stats['tokens_per_sec']}")
+                if token_info:
+                    print("(" + ", ".join(token_info) + ")")
+
+            if output_dir:
+                out_file = output_dir / f"{image.stem}-{args.function}.txt"
+                out_file.write_text(text)
+                print(f"saved → {out_file}")
 
     return 0
 
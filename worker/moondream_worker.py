@@ -18,17 +18,248 @@ from __future__ import annotations
 
 import json
 import os
+import re
 import sqlite3
+import threading
 import time
 import datetime
+import functools
+import hashlib
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    # SIMD-accelerated drop-in for the stdlib encoder; optional.
+    import pybase64 as base64  # type: ignore
+except ImportError:
+    import base64
+
+try:
+    # Downscale + JPEG-encode uploads; optional (without it images are sent as raw bytes).
+    from PIL import Image, ImageStat  # type: ignore
+except ImportError:
+    Image = None
+    ImageStat = None
+
+try:
+    # Only needed alongside sentence-transformers for caption embeddings; optional.
+    import numpy as np  # type: ignore
+except ImportError:
+    np = None
+
+try:
+    # Faster JSON for multi-MB request bodies and per-job DB payloads; optional.
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    # Optional HTTP/2 client for the station (needs the h2 extra); requests stays the default.
+    import httpx  # type: ignore
+except ImportError:
+    httpx = None
+
+try:
+    # libjpeg-turbo JPEG encoder without PIL's per-call overhead (MOONDREAM_IMAGE_BACKEND=simplejpeg).
+    import simplejpeg  # type: ignore
+except ImportError:
+    simplejpeg = None
+
+try:
+    # Decode + INTER_AREA resize with MOONDREAM_IMAGE_BACKEND=opencv; optional.
+    import cv2  # type: ignore
+except ImportError:
+    cv2 = None
+
+# Errors raised by whichever HTTP client a provider ends up using.
+_HTTP_ERRORS = (RequestException,) + ((httpx.HTTPError,) if httpx else ())
 
 _EMBEDDER = None
 _EMBEDDER_MODEL_NAME = None
+# Jobs may run on pool threads; make sure only one of them loads the model.
+_EMBEDDER_LOCK = threading.Lock()
+_CALL_POOL: Optional[Tuple[ThreadPoolExecutor, int]] = None
+_CALL_POOL_LOCK = threading.Lock()
+# Detect responses keyed on (asset sha256, candidate), so duplicate uploads skip the probes.
+_DETECT_CACHE: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+_DETECT_CACHE_LOCK = threading.Lock()
+_DETECT_CACHE_SIZE = 4096
+# MOONDREAM_JPEG_ADAPTIVE: grayscale pixel variance below which an image counts as low-detail,
+# and the JPEG quality used for those.
+_LOW_DETAIL_VARIANCE = 400.0
+_LOW_DETAIL_JPEG_QUALITY = 70
+# Per-thread scratch buffer for the outbound JPEG, reused across calls.
+_JPEG_BUFFERS = threading.local()
+
+# Read size for streamed base64; a multiple of 3 so chunks encode without padding.
+_B64_CHUNK_SIZE = 48 * 1024
+
+_TOKEN_RE = re.compile(r"[a-z]{3,}")
+# Caption words that are never useful detect candidates.
+_STOPWORDS = frozenset(
+    {
+        "the",
+        "and",
+        "with",
+        "without",
+        "from",
+        "into",
+        "over",
+        "under",
+        "near",
+        "behind",
+        "front",
+        "left",
+        "right",
+        "top",
+        "bottom",
+        "this",
+        "that",
+        "these",
+        "those",
+        "there",
+        "here",
+        "image",
+        "photo",
+        "picture",
+        "view",
+        "scene",
+        "very",
+        "more",
+        "most",
+        "some",
+        "many",
+        "few",
+        "one",
+        "two",
+        "three",
+    }
+)
+# Heuristic: strip common non-object modifiers so tags are more "noun-like".
+# (Moondream /query often returns adjective+noun; for tags we prefer the noun.)
+_TAG_MODIFIERS = frozenset(
+    {
+        # articles/structure
+        "a",
+        "an",
+        "the",
+        "of",
+        "and",
+        "with",
+        "without",
+        "in",
+        "on",
+        "at",
+        # colors
+        "white",
+        "black",
+        "red",
+        "green",
+        "blue",
+        "yellow",
+        "orange",
+        "purple",
+        "pink",
+        "brown",
+        "gray",
+        "grey",
+        "gold",
+        "silver",
+        # positions/shapes/common modifiers
+        "left",
+        "right",
+        "top",
+        "bottom",
+        "center",
+        "central",
+        "upper",
+        "lower",
+        "front",
+        "back",
+        "circular",
+        "round",
+        "square",
+        "rectangular",
+        "evenly",
+        "even",
+        "large",
+        "small",
+        "big",
+        "tiny",
+        "smooth",
+        "shiny",
+        "side",
+        # common non-object verbs from captions/query output
+        "show",
+        "shows",
+        "showing",
+        "depict",
+        "depicts",
+        "depicted",
+        "present",
+        "presents",
+        "presenting",
+        "placed",
+        "arranged",
+        # generic non-object terms
+        "image",
+        "photo",
+        "picture",
+        "scene",
+        # number words
+        "one",
+        "two",
+        "three",
+        "four",
+        "five",
+        "six",
+        "seven",
+        "eight",
+        "nine",
+        "ten",
+        "first",
+        "second",
+        "third",
+    }
+)
+_LEADING_ARTICLE_RE = re.compile(r"^(?:a|an|the) ")
+# Word separators for tags and filename slugs: runs of anything outside [a-z0-9].
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+# (connect, read): fail fast when the station isn't listening, but allow slow inference.
+_STATION_TIMEOUT = (3.05, 180)
+# How often the worker's long-lived connection runs PRAGMA optimize.
+_OPTIMIZE_INTERVAL_SECONDS = 15 * 60
+# SQLite errors that mean the connection (not the query) went bad, e.g. the DB file was
+# replaced underneath the worker; main() reopens on these, at most this many times in a row.
+_RECONNECT_ERRORS = (
+    "database is locked",
+    "disk i/o error",
+    "file is not a database",
+    "unable to open database",
+    "no such table",
+)
+_MAX_CONSECUTIVE_RECONNECTS = 3
+
+# Static lookup for the raw-bytes data URL path (avoids loading the system mimetypes DB).
+_EXT_MIME = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+    ".heic": "image/heic",
+}
 
 
 def repo_root_from_here() -> str:
@@ -44,6 +275,251 @@ def now_iso_utc() -> str:
     return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
 
 
+def _b64encode_bytes(data: Any) -> str:
+    if hasattr(base64, "b64encode_as_string"):  # pybase64: straight to str, no .decode pass
+        return base64.b64encode_as_string(data)
+    return base64.b64encode(data).decode("ascii")
+
+
+def _b64encode_file(path: str) -> str:
+    # Stream the file through the encoder so we never hold raw + encoded copies at once.
+    out = bytearray(((os.path.getsize(path) + 2) // 3) * 4)
+    pos = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(_B64_CHUNK_SIZE):
+            encoded = base64.b64encode(chunk)
+            out[pos : pos + len(encoded)] = encoded
+            pos += len(encoded)
+    del out[pos:]
+    return out.decode("ascii")
+
+
+def _json_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def _json_text(obj: Any) -> str:
+    # Compact, unescaped UTF-8 either way, so stored payloads don't depend on whether orjson
+    # is installed.
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def _json_loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _retry_count() -> int:
+    return max(0, int(os.getenv("MOONDREAM_RETRIES", "3") or "3"))
+
+
+def _make_http2_client(endpoint: str) -> Any:
+    """
+    HTTP/2 client for the station, or None (with a warning) when it can't actually speak h2:
+    httpx/h2 missing, or a plain http:// endpoint (httpx only negotiates h2 via TLS ALPN, so
+    it would silently fall back to HTTP/1.1 on a second client).
+    """
+    if httpx is None:
+        print("[worker] MOONDREAM_HTTP2 set but httpx is not installed; using requests")
+        return None
+    if not endpoint.startswith("https://"):
+        print(f"[worker] MOONDREAM_HTTP2 set but {endpoint} is not https (h2 needs TLS); using requests")
+        return None
+    try:
+        # Limits and retries must live on the transport: the Client ignores its own http2/limits
+        # once a transport is given. httpx retries failed connects only (never a sent request),
+        # which matches the read=0 policy of the requests session; 5xx responses are not retried.
+        transport = httpx.HTTPTransport(
+            http2=True,
+            retries=_retry_count(),
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4),
+        )
+    except ImportError as exc:
+        print(f"[worker] MOONDREAM_HTTP2 set but h2 is not available ({exc}); using requests")
+        return None
+    return httpx.Client(
+        transport=transport,
+        headers=_JSON_HEADERS,
+        timeout=httpx.Timeout(_STATION_TIMEOUT[1], connect=_STATION_TIMEOUT[0]),
+    )
+
+
+def _make_session(retries: Optional[int] = None) -> requests.Session:
+    # One pooled keep-alive session per provider so per-asset calls skip connection setup.
+    # Transient failures (connection errors, 502/503/504) are retried with backoff inside the
+    # adapter, so the request body is re-sent without re-encoding the image.
+    if retries is None:
+        retries = _retry_count()
+    retry = Retry(
+        total=retries,
+        # Never re-send an inference request after a read timeout: the station may still be
+        # working on it. Only connect errors and the statuses below are retried.
+        read=0,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(["POST"]),
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _raw_data_url(image_ref: str) -> str:
+    """The file's bytes as-is in a data: URL, typed from its extension."""
+    mime = _EXT_MIME.get(os.path.splitext(image_ref)[1].lower(), "image/png")
+    return "".join(("data:", mime, ";base64,", _b64encode_file(image_ref)))
+
+
+def _downscale_jpeg_torchvision(image_ref: str, max_side: int, jpeg_quality: int) -> bytes:
+    """Decode, antialiased-resize and JPEG-encode with torchvision (libjpeg-turbo, no PIL)."""
+    import torch  # type: ignore
+    from torchvision.io import ImageReadMode, decode_image, encode_jpeg, read_file  # type: ignore
+
+    img = decode_image(read_file(image_ref), mode=ImageReadMode.RGB)  # uint8, CHW
+    h, w = int(img.shape[-2]), int(img.shape[-1])
+    if max_side > 0 and max(w, h) > max_side:
+        scale = max_side / float(max(w, h))
+        size = (max(1, int(round(h * scale))), max(1, int(round(w * scale))))
+        resized = torch.nn.functional.interpolate(
+            img.unsqueeze(0).float(), size=size, mode="bilinear", antialias=True, align_corners=False
+        )
+        img = resized.squeeze(0).round_().clamp_(0, 255).to(torch.uint8)
+    return encode_jpeg(img, quality=jpeg_quality).numpy().tobytes()
+
+
+def _downscale_jpeg_opencv(image_ref: str, max_side: int, jpeg_quality: int) -> bytes:
+    """Decode, area-resize and JPEG-encode with OpenCV (simplejpeg for the encode if present)."""
+    img = cv2.imread(image_ref, cv2.IMREAD_COLOR)  # uint8, HWC, BGR
+    if img is None:
+        raise ValueError(f"cv2 could not decode {image_ref}")
+    h, w = img.shape[:2]
+    if max_side > 0 and max(w, h) > max_side:
+        scale = max_side / float(max(w, h))
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(
+            img, quality=jpeg_quality, colorspace="BGR", colorsubsampling="420", fastdct=True
+        )
+    ok, enc = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    if not ok:
+        raise ValueError(f"cv2 could not encode {image_ref}")
+    return enc.tobytes()
+
+
+@functools.lru_cache(maxsize=4)
+def _encode_image_url(
+    image_ref: str,
+    mtime_ns: int,
+    size: int,
+    raw_mode: bool,
+    max_side: int,
+    jpeg_quality: int,
+    jpeg_optimize: bool,
+    backend: str,
+    adaptive: bool = False,
+) -> str:
+    """
+    Build the data: URL for a local image. Memoized on the file identity and encode settings,
+    so a retried job or the rename query reuses the previous encode.
+    """
+    if raw_mode:
+        return _raw_data_url(image_ref)
+
+    # Optional faster decode/resize/encode backends; PIL below stays the default and fallback.
+    if backend == "torchvision":
+        try:
+            jpeg = _downscale_jpeg_torchvision(image_ref, max_side, jpeg_quality)
+            return "data:image/jpeg;base64," + _b64encode_bytes(jpeg)
+        except Exception:
+            pass
+    elif backend == "opencv" and cv2 is not None:
+        try:
+            jpeg = _downscale_jpeg_opencv(image_ref, max_side, jpeg_quality)
+            return "data:image/jpeg;base64," + _b64encode_bytes(jpeg)
+        except Exception:
+            pass
+
+    if Image is not None:
+        try:
+            with Image.open(image_ref) as im:
+                # A JPEG that already fits and has no APP1 segment (EXIF orientation/GPS, XMP) may
+                # be sent as-is, but only when it is smaller than the re-encode below; otherwise
+                # the re-encode wins as before. open() has only parsed the header at this point.
+                passthrough = (
+                    max_side > 0
+                    and im.format == "JPEG"
+                    and im.mode in ("RGB", "L")
+                    and max(im.size) <= max_side
+                    and not any(marker == "APP1" for marker, _ in getattr(im, "applist", ()))
+                )
+                if max_side > 0 and im.format == "JPEG":
+                    # Have libjpeg decode at 1/2, 1/4 or 1/8 scale (never below max_side)
+                    # instead of decoding every pixel only for resize to discard most of them.
+                    im.draft("RGB", (max_side, max_side))
+                im = im.convert("RGB")
+                w, h = im.size
+                if max_side > 0 and max(w, h) > max_side:
+                    scale = max_side / float(max(w, h))
+                    nw = max(1, int(round(w * scale)))
+                    nh = max(1, int(round(h * scale)))
+                    resample = getattr(Image, "Resampling", Image).LANCZOS
+                    im = im.resize((nw, nh), resample=resample)
+
+                if (
+                    adaptive
+                    and jpeg_quality > _LOW_DETAIL_JPEG_QUALITY
+                    and ImageStat.Stat(im.convert("L")).var[0] < _LOW_DETAIL_VARIANCE
+                ):
+                    jpeg_quality = _LOW_DETAIL_JPEG_QUALITY
+
+                if backend == "simplejpeg" and simplejpeg is not None and np is not None:
+                    # No Huffman-optimize pass here; fastdct is visually the same at these sizes.
+                    jpeg = simplejpeg.encode_jpeg(
+                        np.asarray(im, dtype=np.uint8),
+                        quality=jpeg_quality,
+                        colorspace="RGB",
+                        colorsubsampling="420",
+                        fastdct=True,
+                    )
+                    if passthrough and size <= len(jpeg):
+                        return "data:image/jpeg;base64," + _b64encode_file(image_ref)
+                    return "data:image/jpeg;base64," + _b64encode_bytes(jpeg)
+
+                buf = getattr(_JPEG_BUFFERS, "buf", None)
+                if buf is None:
+                    buf = _JPEG_BUFFERS.buf = io.BytesIO()
+                buf.seek(0)
+                buf.truncate()
+                im.save(
+                    buf,
+                    format="JPEG",
+                    quality=jpeg_quality,
+                    optimize=jpeg_optimize,
+                    progressive=False,
+                    subsampling=2,
+                )
+                if passthrough and size <= buf.tell():
+                    return "data:image/jpeg;base64," + _b64encode_file(image_ref)
+                # Encode straight from the buffer's memory rather than a getvalue() copy. The view
+                # must be released before the next truncate() on this thread's buffer.
+                with buf.getbuffer() as view:
+                    return "data:image/jpeg;base64," + _b64encode_bytes(view)
+        except Exception:
+            pass
+
+    # Fallback: raw bytes in a data URL.
+    return _raw_data_url(image_ref)
+
+
 @dataclass
 class Job:
     asset_id: str
@@ -72,9 +548,21 @@ class MoondreamProvider:
     def query(self, image_path: str, question: str) -> str:
         raise NotImplementedError
 
+    def detect_many(self, image_path: str, objs: List[str]) -> List[Tuple[Any, Optional[Exception]]]:
+        """detect() for several objects concurrently: (response, None) or (None, error) each."""
+        return _call_many(self.detect, image_path, objs)
+
+    def segment_many(self, image_path: str, objs: List[str]) -> List[Tuple[Any, Optional[Exception]]]:
+        """segment() for several objects concurrently: (response, None) or (None, error) each."""
+        return _call_many(self.segment, image_path, objs)
+
     def model_version(self) -> str:
         return "unknown"
 
+    def prepare_image(self, image_path: str) -> str:
+        """Return the image reference to pass to every call of one job."""
+        return image_path
+
 
 class LocalStationProvider(MoondreamProvider):
     def __init__(self, endpoint: str):
@@ -84,6 +572,23 @@ class LocalStationProvider(MoondreamProvider):
         if e.endswith("/v1"):
             e = e[:-3]
         self.endpoint = e
+        self._session = _make_session()
+        # Every station call is a JSON POST; set the header once on the session.
+        self._session.headers.update(_JSON_HEADERS)
+        # Opt-in HTTP/2 for an https:// station: concurrent probes share one multiplexed
+        # connection. Plain-http endpoints keep using the requests session.
+        http2 = (os.getenv("MOONDREAM_HTTP2", "0") or "0").lower() in ("1", "true", "yes")
+        self._http2 = _make_http2_client(self.endpoint) if http2 else None
+
+    def _post(self, url: str, body: Dict[str, Any]) -> Any:
+        if self._http2 is not None:
+            return self._http2.post(url, content=_json_bytes(body))
+        return self._session.post(url, data=_json_bytes(body), timeout=_STATION_TIMEOUT)
+
+    def prepare_image(self, image_path: str) -> str:
+        # Encode once per job; _make_image_url passes data: URLs through unchanged, so the
+        # caption/query/detect/segment calls reuse it instead of re-encoding the image.
+        return self._make_image_url(image_path)
 
     def _make_image_url(self, image_ref: str) -> str:
         """
@@ -96,59 +601,40 @@ class LocalStationProvider(MoondreamProvider):
         if image_ref.startswith("http://") or image_ref.startswith("https://") or image_ref.startswith("data:"):
             return image_ref
 
-        import base64
-        import io
-        import mimetypes
-
         # Allow opting out for debugging.
         raw_mode = (os.getenv("MOONDREAM_RAW_IMAGE_BYTES", "0") or "0").lower() in ("1", "true", "yes")
-        if raw_mode:
-            mime, _ = mimetypes.guess_type(image_ref)
-            if not mime:
-                mime = "image/png"
-            with open(image_ref, "rb") as f:
-                data = base64.b64encode(f.read()).decode("ascii")
-            return f"data:{mime};base64,{data}"
-
         max_side = int(os.getenv("MOONDREAM_MAX_IMAGE_SIDE", "512") or "512")
         jpeg_quality = int(os.getenv("MOONDREAM_JPEG_QUALITY", "85") or "85")
-
-        try:
-            from PIL import Image  # type: ignore
-
-            with Image.open(image_ref) as im:
-                im = im.convert("RGB")
-                w, h = im.size
-                if max_side > 0 and max(w, h) > max_side:
-                    scale = max_side / float(max(w, h))
-                    nw = max(1, int(round(w * scale)))
-                    nh = max(1, int(round(h * scale)))
-                    resample = getattr(Image, "Resampling", Image).LANCZOS
-                    im = im.resize((nw, nh), resample=resample)
-
-                buf = io.BytesIO()
-                im.save(buf, format="JPEG", quality=jpeg_quality, optimize=True)
-                data = base64.b64encode(buf.getvalue()).decode("ascii")
-                return f"data:image/jpeg;base64,{data}"
-        except Exception:
-            # Fallback: raw bytes in a data URL.
-            mime, _ = mimetypes.guess_type(image_ref)
-            if not mime:
-                mime = "image/png"
-            with open(image_ref, "rb") as f:
-                data = base64.b64encode(f.read()).decode("ascii")
-            return f"data:{mime};base64,{data}"
+        # Huffman optimization is a second pass for a few % smaller upload; off by default.
+        jpeg_optimize = (os.getenv("MOONDREAM_JPEG_OPTIMIZE", "0") or "0").lower() in ("1", "true", "yes")
+        backend = (os.getenv("MOONDREAM_IMAGE_BACKEND", "pil") or "pil").lower()
+        # Low-detail images (flat pixel variance) compress much harder without hurting the model.
+        adaptive = (os.getenv("MOONDREAM_JPEG_ADAPTIVE", "0") or "0").lower() in ("1", "true", "yes")
+
+        # Key on mtime/size too, so a file rewritten in place is re-encoded.
+        st = os.stat(image_ref)
+        return _encode_image_url(
+            image_ref,
+            st.st_mtime_ns,
+            st.st_size,
+            raw_mode,
+            max_side,
+            jpeg_quality,
+            jpeg_optimize,
+            backend,
+            adaptive,
+        )
 
     def caption(self, image_path: str, length: str = "normal") -> str:
         url = f"{self.endpoint}/v1/caption"
         body = {"stream": False, "length": length, "image_url": self._make_image_url(image_path)}
         try:
-            r = requests.post(url, json=body, timeout=180)
-        except RequestException as exc:
+            r = self._post(url, body)
+        except _HTTP_ERRORS as exc:
             raise ProviderError(f"station caption request failed: {exc}") from exc
         if r.status_code >= 400:
             raise ProviderError(f"station caption failed: {r.status_code} {r.text}")
-        data = r.json()
+        data = _json_loads(r.content)
         if isinstance(data, dict) and (data.get("error") or data.get("status") in ("rejected", "timeout")):
             raise ProviderError(f"station caption error: {data}")
         caption = (data.get("caption") or data.get("text") or "").strip()
@@ -160,12 +646,12 @@ class LocalStationProvider(MoondreamProvider):
         url = f"{self.endpoint}/v1/detect"
         body = {"stream": False, "object": obj, "image_url": self._make_image_url(image_path)}
         try:
-            r = requests.post(url, json=body, timeout=180)
-        except RequestException as exc:
+            r = self._post(url, body)
+        except _HTTP_ERRORS as exc:
             raise ProviderError(f"station detect request failed: {exc}") from exc
         if r.status_code >= 400:
             raise ProviderError(f"station detect failed: {r.status_code} {r.text}")
-        data = r.json()
+        data = _json_loads(r.content)
         if isinstance(data, dict) and (data.get("error") or data.get("status") in ("rejected", "timeout")):
             raise ProviderError(f"station detect error: {data}")
         return data
@@ -174,12 +660,12 @@ class LocalStationProvider(MoondreamProvider):
         url = f"{self.endpoint}/v1/segment"
         body = {"stream": False, "object": obj, "image_url": self._make_image_url(image_path)}
         try:
-            r = requests.post(url, json=body, timeout=180)
-        except RequestException as exc:
+            r = self._post(url, body)
+        except _HTTP_ERRORS as exc:
             raise ProviderError(f"station segment request failed: {exc}") from exc
         if r.status_code >= 400:
             raise ProviderError(f"station segment failed: {r.status_code} {r.text}")
-        data = r.json()
+        data = _json_loads(r.content)
         if isinstance(data, dict) and (data.get("error") or data.get("status") in ("rejected", "timeout")):
             raise ProviderError(f"station segment error: {data}")
         return data
@@ -188,12 +674,12 @@ class LocalStationProvider(MoondreamProvider):
         url = f"{self.endpoint}/v1/query"
         body = {"stream": False, "question": question, "image_url": self._make_image_url(image_path)}
         try:
-            r = requests.post(url, json=body, timeout=180)
-        except RequestException as exc:
+            r = self._post(url, body)
+        except _HTTP_ERRORS as exc:
             raise ProviderError(f"station query request failed: {exc}") from exc
         if r.status_code >= 400:
             raise ProviderError(f"station query failed: {r.status_code} {r.text}")
-        data = r.json()
+        data = _json_loads(r.content)
         if isinstance(data, dict) and (data.get("error") or data.get("status") in ("rejected", "timeout")):
             raise ProviderError(f"station query error: {data}")
         text = (data.get("answer") or data.get("text") or data.get("caption") or "").strip()
@@ -209,18 +695,21 @@ class HuggingFaceProvider(MoondreamProvider):
     def __init__(self, endpoint_url: str, token: str):
         self.endpoint_url = endpoint_url
         self.token = token
+        # No adapter retries: the body is a streamed file object that can't be replayed.
+        self._session = _make_session(retries=0)
+        self._session.headers["Authorization"] = f"Bearer {token}"
 
     def caption(self, image_path: str, length: str = "normal") -> str:
         # This is intentionally generic; different HF endpoints have different schemas.
         # You can adapt this to your specific endpoint contract.
+        # Hand requests the open file so it streams the body instead of buffering a copy.
+        # An explicit Content-Length keeps it from falling back to chunked encoding.
+        headers = {"Content-Length": str(os.path.getsize(image_path))}
         with open(image_path, "rb") as f:
-            img_bytes = f.read()
-
-        headers = {"Authorization": f"Bearer {self.token}"}
-        r = requests.post(self.endpoint_url, headers=headers, data=img_bytes, timeout=180)
+            r = self._session.post(self.endpoint_url, headers=headers, data=f, timeout=180)
         if r.status_code >= 400:
             raise ProviderError(f"hf failed: {r.status_code} {r.text}")
-        data: Any = r.json()
+        data: Any = _json_loads(r.content)
 
         # Best-effort parsing:
         if isinstance(data, dict):
@@ -254,7 +743,12 @@ class HuggingFaceProvider(MoondreamProvider):
         return "huggingface_endpoint"
 
 
+@functools.lru_cache(maxsize=1)
 def get_provider() -> MoondreamProvider:
+    """
+    The worker's single provider (and with it one pooled HTTP session). Provider env vars are
+    read on the first call only; changing them requires a worker restart.
+    """
     provider = os.getenv("MOONDREAM_PROVIDER", "local_station")
     if provider == "local_station":
         endpoint = os.getenv("MOONDREAM_ENDPOINT", "http://127.0.0.1:2020")
@@ -266,11 +760,113 @@ def get_provider() -> MoondreamProvider:
     raise RuntimeError(f"Unknown MOONDREAM_PROVIDER={provider}")
 
 
+# Hot-path SQL lives in module constants so every call passes the identical string and hits
+# sqlite3's per-connection statement cache instead of being re-prepared.
+_SQL_CLAIM = """
+    UPDATE asset_ai
+    SET status = 'processing', updated_at = ?
+    WHERE asset_id = (
+      SELECT a.id
+      FROM assets a
+      JOIN asset_ai ai ON ai.asset_id = a.id
+      WHERE (ai.status IN {statuses} OR (ai.status = 'processing' AND ai.updated_at < ?))
+        AND a.mime_type LIKE 'image/%'{trash_filter}
+      ORDER BY ai.updated_at ASC
+      LIMIT 1
+    )
+    RETURNING asset_id
+    """
+
+_SQL_FETCH_JOB = """
+    SELECT
+      a.id AS asset_id,
+      a.project_id,
+      a.original_name,
+      a.mime_type,
+      a.storage_path,
+      a.storage_url,
+      a.sha256
+    FROM assets a
+    WHERE a.id = ?
+    """
+
+_SQL_WRITE_RESULTS = """
+    UPDATE asset_ai
+    SET caption = ?,
+        tags_json = ?,
+        status = ?,
+        model_version = ?,
+        updated_at = ?
+    WHERE asset_id = ?
+    """
+
+_SQL_RENAME_ASSET = "UPDATE assets SET original_name = ? WHERE id = ?"
+
+_SQL_UPSERT_EMBEDDING = """
+    INSERT INTO asset_embeddings (asset_id, model, dim, embedding, updated_at)
+    VALUES (?, ?, ?, ?, datetime('now'))
+    ON CONFLICT(asset_id) DO UPDATE SET
+      model=excluded.model,
+      dim=excluded.dim,
+      embedding=excluded.embedding,
+      updated_at=excluded.updated_at
+    """
+
+_SQL_UPSERT_SEGMENT = """
+    INSERT INTO asset_segments (asset_id, tag, svg, bbox_json, updated_at)
+    VALUES (?, ?, ?, ?, datetime('now'))
+    ON CONFLICT(asset_id, tag) DO UPDATE SET
+      svg=excluded.svg,
+      bbox_json=excluded.bbox_json,
+      updated_at=excluded.updated_at
+    """
+
+_SQL_DELETE_SEGMENTS = "DELETE FROM asset_segments WHERE asset_id = ?"
+
+_SQL_DELETE_SEGMENTS_NOT_IN = """
+    DELETE FROM asset_segments
+    WHERE asset_id = ? AND tag NOT IN (SELECT value FROM json_each(?))
+    """
+
+_SQL_SELECT_TEXT_EMBEDS = """
+    SELECT text_hash, dim, embedding FROM text_embed_cache
+    WHERE model = ? AND text_hash IN (SELECT value FROM json_each(?))
+    """
+
+_SQL_INSERT_TEXT_EMBED = """
+    INSERT OR IGNORE INTO text_embed_cache (text_hash, model, dim, embedding)
+    VALUES (?, ?, ?, ?)
+    """
+
+_SQL_DELETE_SEARCH = "DELETE FROM asset_search WHERE asset_id = ?"
+
+# Only index assets that still exist: one deleted between claim and store gets no orphan row.
+_SQL_INSERT_SEARCH = """
+    INSERT INTO asset_search (asset_id, project_id, original_name, caption, tags)
+    SELECT ?, ?, ?, ?, ?
+    WHERE EXISTS (SELECT 1 FROM assets WHERE id = ?)
+    """
+
+
 def connect(db_path: str) -> sqlite3.Connection:
-    con = sqlite3.connect(db_path)
+    # Autocommit mode: every write transaction below is an explicit BEGIN IMMEDIATE ... COMMIT,
+    # which takes the write lock up front instead of upgrading (and deadlocking) mid-transaction.
+    con = sqlite3.connect(db_path, isolation_level=None, cached_statements=256)
     con.row_factory = sqlite3.Row
     con.execute("PRAGMA foreign_keys = ON")
     con.execute("PRAGMA busy_timeout = 5000")
+    # WAL lets the Next.js app keep reading while the worker commits.
+    con.execute("PRAGMA journal_mode = WAL")
+    con.execute("PRAGMA synchronous = NORMAL")
+    con.execute("PRAGMA temp_store = MEMORY")
+    con.execute("PRAGMA mmap_size = 268435456")
+    con.execute("PRAGMA cache_size = -65536")
+    # Keep a job's dirty pages in memory until COMMIT rather than spilling them mid-transaction.
+    con.execute("PRAGMA cache_spill = OFF")
+    return con
+
+
+def ensure_schema(con: sqlite3.Connection) -> None:
     # Best-effort schema ensure so the worker can run before the Next.js app has applied migrations.
     con.execute(
         """
@@ -296,56 +892,60 @@ def connect(db_path: str) -> sqlite3.Connection:
         """
     )
     con.execute("CREATE INDEX IF NOT EXISTS asset_segments_tag_idx ON asset_segments(tag)")
-    return con
+    # Worker-private cache of caption embeddings (MOONDREAM_EMBED_CACHE), keyed on the text.
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS text_embed_cache (
+          text_hash TEXT NOT NULL,
+          model TEXT NOT NULL,
+          dim INTEGER NOT NULL,
+          embedding BLOB NOT NULL,
+          PRIMARY KEY (text_hash, model)
+        )
+        """
+    )
 
 
-def fetch_next_job(con: sqlite3.Connection) -> Optional[Job]:
+def claim_next_job(con: sqlite3.Connection) -> Optional[Job]:
+    """
+    Atomically flip the oldest eligible asset to 'processing' and return it.
+    The claim is a single UPDATE ... RETURNING so there is no read-then-write window.
+    """
     retry_failed = (os.getenv("MOONDREAM_RETRY_FAILED", "0") or "0").lower() in ("1", "true", "yes")
-    statuses = "('pending','processing','failed')" if retry_failed else "('pending','processing')"
+    statuses = "('pending','failed')" if retry_failed else "('pending')"
+    # The claim stamps updated_at, which doubles as a lease: a 'processing' row is only taken
+    # over once it is older than MOONDREAM_CLAIM_LEASE_SECONDS (its worker presumably died), so
+    # other workers and this worker's own job pool never re-claim a job that is in flight.
+    lease = float(os.getenv("MOONDREAM_CLAIM_LEASE_SECONDS", "900") or "900")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    expired_before = (now - datetime.timedelta(seconds=lease)).isoformat().replace("+00:00", "Z")
     # IMPORTANT: assets can be "trashed" (deleted_at set) while keeping asset_ai rows around.
     # In that case, the file is moved into a per-project trash folder and the original storage_path
     # no longer exists. Skip trashed assets to avoid endless file-not-found retries.
-    sql_with_trash_filter = f"""
-        SELECT
-          a.id AS asset_id,
-          a.project_id,
-          a.original_name,
-          a.mime_type,
-          a.storage_path,
-          a.storage_url,
-          a.sha256
-        FROM assets a
-        JOIN asset_ai ai ON ai.asset_id = a.id
-        WHERE ai.status IN {statuses}
-          AND a.mime_type LIKE 'image/%'
-          AND a.deleted_at IS NULL
-        ORDER BY ai.updated_at ASC
-        LIMIT 1
-        """
-    sql_without_trash_filter = f"""
-        SELECT
-          a.id AS asset_id,
-          a.project_id,
-          a.original_name,
-          a.mime_type,
-          a.storage_path,
-          a.storage_url,
-          a.sha256
-        FROM assets a
-        JOIN asset_ai ai ON ai.asset_id = a.id
-        WHERE ai.status IN {statuses} AND a.mime_type LIKE 'image/%'
-        ORDER BY ai.updated_at ASC
-        LIMIT 1
-        """
+    sql_with_trash_filter = _SQL_CLAIM.format(
+        statuses=statuses, trash_filter="\n        AND a.deleted_at IS NULL"
+    )
+    sql_without_trash_filter = _SQL_CLAIM.format(statuses=statuses, trash_filter="")
+    ts = now.isoformat().replace("+00:00", "Z")
+    con.execute("BEGIN IMMEDIATE")
     try:
-        row = con.execute(sql_with_trash_filter).fetchone()
-    except sqlite3.OperationalError as exc:
-        # Backwards compatibility: older DBs might not have deleted_at yet.
-        msg = str(exc).lower()
-        if "no such column" in msg and "deleted_at" in msg:
-            row = con.execute(sql_without_trash_filter).fetchone()
-        else:
-            raise
+        try:
+            claimed = con.execute(sql_with_trash_filter, (ts, expired_before)).fetchall()
+        except sqlite3.OperationalError as exc:
+            # Backwards compatibility: older DBs might not have deleted_at yet.
+            msg = str(exc).lower()
+            if "no such column" in msg and "deleted_at" in msg:
+                claimed = con.execute(sql_without_trash_filter, (ts, expired_before)).fetchall()
+            else:
+                raise
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    if not claimed:
+        return None
+
+    row = con.execute(_SQL_FETCH_JOB, (claimed[0]["asset_id"],)).fetchone()
     if not row:
         return None
     return Job(
@@ -359,14 +959,6 @@ def fetch_next_job(con: sqlite3.Connection) -> Optional[Job]:
     )
 
 
-def set_status(con: sqlite3.Connection, asset_id: str, status: str) -> None:
-    ts = now_iso_utc()
-    con.execute(
-        "UPDATE asset_ai SET status = ?, updated_at = ? WHERE asset_id = ?",
-        (status, ts, asset_id),
-    )
-
-
 def write_results(
     con: sqlite3.Connection,
     asset_id: str,
@@ -377,276 +969,110 @@ def write_results(
 ) -> None:
     ts = now_iso_utc()
     con.execute(
-        """
-        UPDATE asset_ai
-        SET caption = ?,
-            tags_json = ?,
-            status = ?,
-            model_version = ?,
-            updated_at = ?
-        WHERE asset_id = ?
-        """,
-        (caption, json.dumps(tags), status, model_version, ts, asset_id),
+        _SQL_WRITE_RESULTS,
+        (caption, _json_text(tags), status, model_version, ts, asset_id),
     )
 
 
-def update_search_index(con: sqlite3.Connection, asset_id: str) -> None:
-    row = con.execute(
-        """
-        SELECT a.id, a.project_id, a.original_name, ai.caption, ai.tags_json
-        FROM assets a
-        LEFT JOIN asset_ai ai ON ai.asset_id = a.id
-        WHERE a.id = ?
-        """,
-        (asset_id,),
-    ).fetchone()
-    if not row:
-        return
-    tags_text = ""
-    try:
-        tags = json.loads(row["tags_json"] or "[]")
-        if isinstance(tags, list):
-            tags_text = " ".join([str(t) for t in tags if t])
-    except Exception:
-        tags_text = ""
+def reset_results(con: sqlite3.Connection, job: Job, status: str, model_version: str) -> None:
+    """Clear an asset's AI output and set its status in a single write transaction."""
+    if con.in_transaction:
+        # A write failed partway through the success path; drop it before recording the outcome.
+        con.execute("ROLLBACK")
+    con.execute("BEGIN IMMEDIATE")
+    write_results(con, job.asset_id, caption="", tags=[], status=status, model_version=model_version)
+    delete_segments_not_in(con, job.asset_id, [])
+    update_search_index(con, job.asset_id, job.project_id, job.original_name, caption="", tags_text="")
+    con.execute("COMMIT")
+
 
-    # Keep parity with TS: delete then insert.
-    con.execute("DELETE FROM asset_search WHERE asset_id = ?", (asset_id,))
+def update_search_index(
+    con: sqlite3.Connection,
+    asset_id: str,
+    project_id: str,
+    original_name: str,
+    caption: str,
+    tags_text: str,
+) -> None:
+    # asset_search is an FTS5 table, so there is no UNIQUE(asset_id) to UPSERT against.
+    # Keep parity with TS (delete then insert). The caller already has the caption, tags and
+    # name it just wrote, so the row is built from those instead of being read back.
+    con.execute(_SQL_DELETE_SEARCH, (asset_id,))
     con.execute(
-        """
-        INSERT INTO asset_search (asset_id, project_id, original_name, caption, tags)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (row["id"], row["project_id"], row["original_name"], row["caption"] or "", tags_text),
+        _SQL_INSERT_SEARCH, (asset_id, project_id, original_name, caption or "", tags_text, asset_id)
     )
 
+
 def _tokenize_candidates(text: str) -> List[str]:
     # Very lightweight candidate extraction (MVP). We keep it deterministic and cheap.
     # Note: detect will be the filter/ground-truth.
-    stop = {
-        "the",
-        "and",
-        "with",
-        "without",
-        "from",
-        "into",
-        "over",
-        "under",
-        "near",
-        "behind",
-        "front",
-        "left",
-        "right",
-        "top",
-        "bottom",
-        "this",
-        "that",
-        "these",
-        "those",
-        "there",
-        "here",
-        "image",
-        "photo",
-        "picture",
-        "view",
-        "scene",
-        "very",
-        "more",
-        "most",
-        "some",
-        "many",
-        "few",
-        "one",
-        "two",
-        "three",
-    }
-    raw = (
-        text.lower()
-        .replace("\n", " ")
-        .replace("\t", " ")
-        .replace("/", " ")
-        .replace("\\", " ")
-    )
-    tokens = []
-    buf = []
-    for ch in raw:
-        if "a" <= ch <= "z" or ch == " ":
-            buf.append(ch)
-        else:
-            buf.append(" ")
-    for t in "".join(buf).split():
-        if len(t) < 3:
-            continue
-        if t in stop:
-            continue
-        tokens.append(t)
+    # Tokens are maximal runs of a-z (everything else separates), at least 3 letters long.
+    tokens = [t for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
     # Preserve rough relevance by first occurrence order, but de-dupe.
-    seen = set()
-    out = []
-    for t in tokens:
-        if t in seen:
-            continue
-        seen.add(t)
-        out.append(t)
-    return out
-
-
-def _parse_object_candidates_from_query_text(text: str) -> List[str]:
-    """
-    Turn a /query response into a list of object candidate strings.
-    Supports:
-    - JSON array: ["cat","sofa",...]
-    - Comma/newline separated: "cat, sofa, coffee table"
-    """
-    raw = (text or "").strip()
-    if not raw:
-        return []
-
-    # First: try JSON array.
-    try:
-        parsed = json.loads(raw)
-        if isinstance(parsed, list):
-            out: List[str] = []
-            for v in parsed:
-                if isinstance(v, str) and v.strip():
-                    out.append(v.strip())
-            return out
-    except Exception:
-        pass
-
-    # Otherwise: split by common separators.
-    parts: List[str] = []
-    for sep in ("\n", ",", ";"):
-        if sep in raw:
-            parts = [p.strip() for p in raw.replace("\r", "\n").split(sep)]
-            break
-    if not parts:
-        parts = [raw]
-
-    out2: List[str] = []
-    for p in parts:
-        if not p:
-            continue
-        # Remove bullet prefix.
-        p2 = p.lstrip("-•*").strip()
-        if not p2:
-            continue
-        out2.append(p2)
-    return out2
-
-
-def _normalize_tag_candidate(s: str) -> str:
-    # Lowercase, keep letters/numbers/spaces, collapse whitespace.
-    t = (s or "").strip().lower()
-    if not t:
-        return ""
-    t = t.replace("_", " ").replace("-", " ")
-    buf: List[str] = []
-    for ch in t:
-        if ("a" <= ch <= "z") or ("0" <= ch <= "9") or ch == " ":
-            buf.append(ch)
-        else:
-            buf.append(" ")
-    t = " ".join("".join(buf).split())
-    # Strip leading articles.
-    for art in ("a ", "an ", "the "):
-        if t.startswith(art):
-            t = t[len(art) :].strip()
-            break
-    words = t.split()
-    if not words:
-        return ""
+    return list(dict.fromkeys(tokens))
 
-    # Heuristic: strip common non-object modifiers so tags are more "noun-like".
-    # (Moondream /query often returns adjective+noun; for tags we prefer the noun.)
-    modifiers = {
-        # articles/structure
-        "a",
-        "an",
-        "the",
-        "of",
-        "and",
-        "with",
-        "without",
-        "in",
-        "on",
-        "at",
-        # colors
-        "white",
-        "black",
-        "red",
-        "green",
-        "blue",
-        "yellow",
-        "orange",
-        "purple",
-        "pink",
-        "brown",
-        "gray",
-        "grey",
-        "gold",
-        "silver",
-        # positions/shapes/common modifiers
-        "left",
-        "right",
-        "top",
-        "bottom",
-        "center",
-        "central",
-        "upper",
-        "lower",
-        "front",
-        "back",
-        "circular",
-        "round",
-        "square",
-        "rectangular",
-        "evenly",
-        "even",
-        "large",
-        "small",
-        "big",
-        "tiny",
-        "smooth",
-        "shiny",
-        "side",
-        # common non-object verbs from captions/query output
-        "show",
-        "shows",
-        "showing",
-        "depict",
-        "depicts",
-        "depicted",
-        "present",
-        "presents",
-        "presenting",
-        "placed",
-        "arranged",
-        # generic non-object terms
-        "image",
-        "photo",
-        "picture",
-        "scene",
-        # number words
-        "one",
-        "two",
-        "three",
-        "four",
-        "five",
-        "six",
-        "seven",
-        "eight",
-        "nine",
-        "ten",
-        "first",
-        "second",
-        "third",
-    }
+
+def _parse_object_candidates_from_query_text(text: str) -> List[str]:
+    """
+    Turn a /query response into a list of object candidate strings.
+    Supports:
+    - JSON array: ["cat","sofa",...]
+    - Comma/newline separated: "cat, sofa, coffee table"
+    """
+    raw = (text or "").strip()
+    if not raw:
+        return []
+
+    # First: try JSON array.
+    try:
+        parsed = _json_loads(raw)
+        if isinstance(parsed, list):
+            out: List[str] = []
+            for v in parsed:
+                if isinstance(v, str) and v.strip():
+                    out.append(v.strip())
+            return out
+    except Exception:
+        pass
+
+    # Otherwise: split by common separators.
+    parts: List[str] = []
+    for sep in ("\n", ",", ";"):
+        if sep in raw:
+            parts = [p.strip() for p in raw.replace("\r", "\n").split(sep)]
+            break
+    if not parts:
+        parts = [raw]
+
+    out2: List[str] = []
+    for p in parts:
+        if not p:
+            continue
+        # Remove bullet prefix.
+        p2 = p.lstrip("-•*").strip()
+        if not p2:
+            continue
+        out2.append(p2)
+    return out2
+
+
+def _normalize_tag_candidate(s: str) -> str:
+    # Lowercase, keep letters/numbers/spaces, collapse whitespace.
+    t = (s or "").strip().lower()
+    if not t:
+        return ""
+    # Anything outside [a-z0-9] (including "_" and "-") separates words.
+    t = " ".join(_NON_ALNUM_RE.sub(" ", t).split())
+    # Strip one leading article (t is already single-spaced and trimmed).
+    t = _LEADING_ARTICLE_RE.sub("", t, count=1)
+    words = t.split()
+    if not words:
+        return ""
 
     # Prefer keeping noun phrases (e.g. "coffee table"), but drop leading modifiers.
-    pruned = [w for w in words if w and w not in modifiers and not w.isdigit()]
+    pruned = [w for w in words if w and w not in _TAG_MODIFIERS and not w.isdigit()]
     # If a candidate is only modifiers/numbers, drop it entirely.
-    if not pruned and all((w in modifiers or w.isdigit()) for w in words):
+    if not pruned and all((w in _TAG_MODIFIERS or w.isdigit()) for w in words):
         return ""
     if pruned:
         words = pruned
@@ -660,7 +1086,9 @@ def _normalize_tag_candidate(s: str) -> str:
     return t
 
 
-def _dedupe_preserve_order(items: List[str]) -> List[str]:
+def _dedupe_preserve_order(items: Iterable[str], limit: Optional[int] = None) -> List[str]:
+    # With a limit we stop consuming items once enough unique ones are collected, so a lazy
+    # input (e.g. a generator that normalizes) only does the work for the items we keep.
     seen = set()
     out: List[str] = []
     for it in items:
@@ -670,6 +1098,8 @@ def _dedupe_preserve_order(items: List[str]) -> List[str]:
             continue
         seen.add(it)
         out.append(it)
+        if limit is not None and len(out) >= limit:
+            break
     return out
 
 
@@ -695,17 +1125,23 @@ def _extract_detect_boxes(detect_response: Any) -> List[Dict[str, Any]]:
                 data = data.get(key)
                 break
     boxes: List[Dict[str, Any]] = []
+    append = boxes.append
     if isinstance(data, list):
         for item in data:
             if isinstance(item, dict):
+                # Look keys up directly (EAFP); a KeyError just means "not this shape".
                 # Moondream-style min/max coords (normalized 0..1)
-                if all(k in item for k in ("x_min", "y_min", "x_max", "y_max")):
+                try:
+                    coords = (item["x_min"], item["y_min"], item["x_max"], item["y_max"])
+                except KeyError:
+                    coords = None
+                if coords is not None:
                     try:
-                        x_min = float(item.get("x_min"))
-                        y_min = float(item.get("y_min"))
-                        x_max = float(item.get("x_max"))
-                        y_max = float(item.get("y_max"))
-                        boxes.append(
+                        x_min = float(coords[0])
+                        y_min = float(coords[1])
+                        x_max = float(coords[2])
+                        y_max = float(coords[3])
+                        append(
                             {
                                 "x": x_min,
                                 "y": y_min,
@@ -721,30 +1157,28 @@ def _extract_detect_boxes(detect_response: Any) -> List[Dict[str, Any]]:
                     except Exception:
                         pass
                     continue
-                if all(k in item for k in ("x", "y", "w", "h")):
-                    boxes.append(
+                try:
+                    xywh = (item["x"], item["y"], item["w"], item["h"])
+                except KeyError:
+                    xywh = None
+                if xywh is None:
+                    b = item.get("box")
+                    if isinstance(b, dict):
+                        try:
+                            xywh = (b["x"], b["y"], b["w"], b["h"])
+                        except KeyError:
+                            xywh = None
+                if xywh is not None:
+                    append(
                         {
-                            "x": float(item.get("x")),
-                            "y": float(item.get("y")),
-                            "w": float(item.get("w")),
-                            "h": float(item.get("h")),
+                            "x": float(xywh[0]),
+                            "y": float(xywh[1]),
+                            "w": float(xywh[2]),
+                            "h": float(xywh[3]),
                             "score": item.get("score"),
                         }
                     )
                     continue
-                if "box" in item and isinstance(item["box"], dict):
-                    b = item["box"]
-                    if all(k in b for k in ("x", "y", "w", "h")):
-                        boxes.append(
-                            {
-                                "x": float(b.get("x")),
-                                "y": float(b.get("y")),
-                                "w": float(b.get("w")),
-                                "h": float(b.get("h")),
-                                "score": item.get("score"),
-                            }
-                        )
-                        continue
             if isinstance(item, (list, tuple)) and len(item) == 4:
                 x1, y1, x2, y2 = item
                 try:
@@ -752,10 +1186,11 @@ def _extract_detect_boxes(detect_response: Any) -> List[Dict[str, Any]]:
                     y1f = float(y1)
                     x2f = float(x2)
                     y2f = float(y2)
-                    boxes.append({"x": x1f, "y": y1f, "w": x2f - x1f, "h": y2f - y1f})
+                    append({"x": x1f, "y": y1f, "w": x2f - x1f, "h": y2f - y1f})
                 except Exception:
                     continue
-    return [b for b in boxes if b.get("w") and b.get("h") and b.get("w") > 0 and b.get("h") > 0]
+    # Every box above has float w/h; "> 0" also rejects 0.0 and NaN.
+    return [b for b in boxes if b["w"] > 0 and b["h"] > 0]
 
 
 def _extract_segment_svg(segment_response: Any) -> Optional[str]:
@@ -820,20 +1255,12 @@ def _extract_segment_bbox(segment_response: Any) -> Optional[Dict[str, Any]]:
     return None
 
 
-def upsert_segment_row(
-    con: sqlite3.Connection, asset_id: str, tag: str, svg: Optional[str], bbox_json: Optional[str]
+def upsert_segment_rows(
+    con: sqlite3.Connection, asset_id: str, rows: List[Tuple[str, Optional[str], Optional[str]]]
 ) -> None:
-    con.execute(
-        """
-        INSERT INTO asset_segments (asset_id, tag, svg, bbox_json, updated_at)
-        VALUES (?, ?, ?, ?, datetime('now'))
-        ON CONFLICT(asset_id, tag) DO UPDATE SET
-          svg=excluded.svg,
-          bbox_json=excluded.bbox_json,
-          updated_at=excluded.updated_at
-        """,
-        (asset_id, tag, svg, bbox_json),
-    )
+    """Upsert (tag, svg, bbox_json) rows for one asset with a single executemany."""
+    con.executemany(_SQL_UPSERT_SEGMENT, [(asset_id, tag, svg, bbox_json) for tag, svg, bbox_json in rows])
+
 
 def upsert_embedding_row(
     con: sqlite3.Connection,
@@ -842,18 +1269,35 @@ def upsert_embedding_row(
     dim: int,
     embedding_blob: Optional[bytes],
 ) -> None:
-    con.execute(
-        """
-        INSERT INTO asset_embeddings (asset_id, model, dim, embedding, updated_at)
-        VALUES (?, ?, ?, ?, datetime('now'))
-        ON CONFLICT(asset_id) DO UPDATE SET
-          model=excluded.model,
-          dim=excluded.dim,
-          embedding=excluded.embedding,
-          updated_at=excluded.updated_at
-        """,
-        (asset_id, model, dim, embedding_blob),
-    )
+    con.execute(_SQL_UPSERT_EMBEDDING, (asset_id, model, dim, embedding_blob))
+
+
+def _apply_embed_precision(model: Any) -> Any:
+    """
+    Optionally run the embedder at reduced precision (MOONDREAM_EMBED_PRECISION):
+    fp16 on CUDA, or dynamic int8 quantization of the Linear layers on CPU.
+    Falls back to fp32 if torch can't do it; vectors stay L2-normalized either way.
+    """
+    precision = (os.getenv("MOONDREAM_EMBED_PRECISION", "fp32") or "fp32").lower()
+    if precision not in ("fp16", "int8"):
+        return model
+    try:
+        import torch  # type: ignore
+
+        if precision == "fp16":
+            if not torch.cuda.is_available():
+                print("[worker] MOONDREAM_EMBED_PRECISION=fp16 needs CUDA; keeping fp32")
+                return model
+            return model.half().to("cuda")
+
+        from torch.ao.quantization import quantize_dynamic  # type: ignore
+
+        model = model.to("cpu")
+        model[0].auto_model = quantize_dynamic(model[0].auto_model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+    except Exception as exc:
+        print(f"[worker] MOONDREAM_EMBED_PRECISION={precision} not applied: {exc}")
+        return model
 
 
 def _get_embedder() -> Tuple[Optional[Any], Optional[str]]:
@@ -865,60 +1309,126 @@ def _get_embedder() -> Tuple[Optional[Any], Optional[str]]:
     model_name = os.getenv("MOONDREAM_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     if _EMBEDDER is not None and _EMBEDDER_MODEL_NAME == model_name:
         return _EMBEDDER, _EMBEDDER_MODEL_NAME
-    try:
-        from sentence_transformers import SentenceTransformer  # type: ignore
+    with _EMBEDDER_LOCK:
+        if _EMBEDDER is not None and _EMBEDDER_MODEL_NAME == model_name:
+            return _EMBEDDER, _EMBEDDER_MODEL_NAME
+        try:
+            from sentence_transformers import SentenceTransformer  # type: ignore
 
-        _EMBEDDER = SentenceTransformer(model_name)
-        _EMBEDDER_MODEL_NAME = model_name
-        return _EMBEDDER, _EMBEDDER_MODEL_NAME
-    except Exception as exc:
-        print(f"[worker] embeddings disabled (sentence-transformers not available): {exc}")
-        _EMBEDDER = None
-        _EMBEDDER_MODEL_NAME = None
-        return None, None
+            _EMBEDDER = _apply_embed_precision(SentenceTransformer(model_name))
+            _EMBEDDER_MODEL_NAME = model_name
+            return _EMBEDDER, _EMBEDDER_MODEL_NAME
+        except Exception as exc:
+            print(f"[worker] embeddings disabled (sentence-transformers not available): {exc}")
+            _EMBEDDER = None
+            _EMBEDDER_MODEL_NAME = None
+            return None, None
 
 
-def embed_text_to_f32_blob(text: str) -> Tuple[Optional[str], Optional[int], Optional[bytes]]:
+def _stored_embed_model(model_name: str) -> str:
+    """Model string stored with a blob: embedder name plus the MOONDREAM_EMBED_DTYPE suffix."""
+    dtype = (os.getenv("MOONDREAM_EMBED_DTYPE", "f32") or "f32").lower()
+    if dtype in ("int8", "fp16"):
+        return f"{model_name}_{dtype}"
+    return model_name
+
+
+def _text_embed_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embed_texts_cached(
+    con: sqlite3.Connection, texts: List[str]
+) -> Tuple[Optional[str], Optional[int], List[Optional[bytes]]]:
+    """
+    embed_texts_to_f32_blobs, answering texts embedded before from text_embed_cache when
+    MOONDREAM_EMBED_CACHE is set. New vectors are cached by store_results().
+    """
+    use_cache = (os.getenv("MOONDREAM_EMBED_CACHE", "0") or "0").lower() in ("1", "true", "yes")
+    if not use_cache or not texts:
+        return embed_texts_to_f32_blobs(texts)
     emb, model_name = _get_embedder()
     if emb is None or model_name is None:
-        return None, None, None
+        return embed_texts_to_f32_blobs(texts)
+    model = _stored_embed_model(model_name)
+    keys = [_text_embed_key(t) for t in texts]
+    cached: Dict[str, Tuple[int, bytes]] = {}
     try:
-        import numpy as np  # type: ignore
-
-        vec = emb.encode([text], normalize_embeddings=True)[0]
-        arr = np.asarray(vec, dtype=np.float32)
-        return model_name, int(arr.shape[0]), arr.tobytes()
+        for row in con.execute(_SQL_SELECT_TEXT_EMBEDS, (model, _json_text(keys))):
+            cached[row["text_hash"]] = (int(row["dim"]), row["embedding"])
+    except sqlite3.OperationalError as exc:
+        # e.g. text_embed_cache is missing; the cache is an optimization, so just encode.
+        print(f"[worker] embedding cache unavailable: {exc}")
+        return embed_texts_to_f32_blobs(texts)
+    misses = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in cached))
+    if misses:
+        miss_model, miss_dim, miss_blobs = embed_texts_to_f32_blobs(misses)
+        if miss_model != model:
+            # Encoding failed; keep the batch all-or-nothing like the uncached path.
+            return None, None, [None] * len(texts)
+        for text, blob in zip(misses, miss_blobs):
+            cached[_text_embed_key(text)] = (miss_dim, blob)
+    dim = next(iter(cached.values()))[0]
+    return model, dim, [cached[k][1] for k in keys]
+
+
+def embed_texts_to_f32_blobs(texts: List[str]) -> Tuple[Optional[str], Optional[int], List[Optional[bytes]]]:
+    """
+    Embed several captions with a single encode call (sentence-transformers batches
+    internally). Blobs are None when embeddings are unavailable or fail.
+    """
+    none: List[Optional[bytes]] = [None] * len(texts)
+    if not texts:
+        return None, None, none
+    emb, model_name = _get_embedder()
+    if emb is None or model_name is None:
+        return None, None, none
+    try:
+        batch_size = max(1, int(os.getenv("MOONDREAM_EMBED_BATCH_SIZE", "32") or "32"))
+        vecs = emb.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True)
+        arr = np.ascontiguousarray(vecs, dtype=np.float32)
+        dim = int(arr.shape[1])
+
+        # MOONDREAM_EMBED_DTYPE=f32 (default) | fp16 (little-endian float16 x dim) | int8.
+        # Opt-in int8 storage: per-vector float32 scale (little-endian) followed by dim int8s,
+        # ~4x smaller than float32. The model string gets a suffix so readers can tell.
+        stored_model = _stored_embed_model(model_name)
+        if stored_model.endswith("_int8"):
+            scales = np.abs(arr).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            q = np.round(arr / scales[:, None]).astype(np.int8)
+            scales = scales.astype("<f4")
+            blobs = [scales[i].tobytes() + q[i].tobytes() for i in range(len(texts))]
+            return stored_model, dim, blobs
+        if stored_model.endswith("_fp16"):
+            # Half the size of float32; cosine ranking of normalized vectors is unaffected.
+            arr16 = arr.astype("<f2")
+            return stored_model, dim, [row.tobytes() for row in arr16]
+        return stored_model, dim, [row.tobytes() for row in arr]
     except Exception as exc:
         print(f"[worker] embedding failed: {exc}")
-        return None, None, None
+        return None, None, none
+
+
+def embed_text_to_f32_blob(text: str) -> Tuple[Optional[str], Optional[int], Optional[bytes]]:
+    model_name, dim, blobs = embed_texts_to_f32_blobs([text])
+    return model_name, dim, blobs[0]
 
 
 def delete_segments_not_in(con: sqlite3.Connection, asset_id: str, keep_tags: List[str]) -> None:
+    # The keep-list goes in as one JSON array, so this is a single cached statement with a
+    # stable plan whatever the tag count. The failure paths keep nothing; that is a plain
+    # primary-key range delete with no json_each scan.
     if not keep_tags:
-        con.execute("DELETE FROM asset_segments WHERE asset_id = ?", (asset_id,))
+        con.execute(_SQL_DELETE_SEGMENTS, (asset_id,))
         return
-    placeholders = ",".join(["?"] * len(keep_tags))
-    con.execute(
-        f"DELETE FROM asset_segments WHERE asset_id = ? AND tag NOT IN ({placeholders})",
-        [asset_id, *keep_tags],
-    )
+    con.execute(_SQL_DELETE_SEGMENTS_NOT_IN, (asset_id, _json_text(keep_tags)))
 
 
 def _slugify_filename_base(text: str) -> str:
     raw = (text or "").strip().lower()
-    # Keep it filesystem-friendly.
-    out: List[str] = []
-    dash = False
-    for ch in raw:
-        if "a" <= ch <= "z" or "0" <= ch <= "9":
-            out.append(ch)
-            dash = False
-        else:
-            if not dash:
-                out.append("-")
-                dash = True
-    slug = "".join(out).strip("-")
-    slug = "-".join([p for p in slug.split("-") if p])
+    # Keep it filesystem-friendly: runs of anything outside [a-z0-9] become a single dash.
+    slug = _NON_ALNUM_RE.sub("-", raw).strip("-")
     # Reasonable length for filenames.
     return slug[:64]
 
@@ -931,14 +1441,15 @@ def _pick_extension(job: Job) -> str:
     return ext2 or ""
 
 
-def maybe_rename_asset(con: sqlite3.Connection, job: Job, caption: str, provider: MoondreamProvider) -> None:
+def maybe_rename_asset(con: sqlite3.Connection, job: Job, caption: str, provider: MoondreamProvider) -> Optional[str]:
     """
     Generate a nicer name via Moondream and:
     - update assets.original_name (display/search)
     - create a named alias file on disk (symlink) without touching the content-addressed storage file
+    Returns the new display name, or None if the asset was not renamed.
     """
     if (os.getenv("MOONDREAM_GENERATE_NAMES", "1") or "1") in ("0", "false", "False"):
-        return
+        return None
 
     # Naming strategy:
     # - default: derive from caption (already from Moondream) to avoid extra API calls
@@ -959,40 +1470,53 @@ def maybe_rename_asset(con: sqlite3.Connection, job: Job, caption: str, provider
     if not title:
         title = (caption or "").strip()
     if not title:
-        return
+        return None
 
     base = _slugify_filename_base(title)
     if not base:
-        return
+        return None
 
     ext = _pick_extension(job)
     sha8 = (job.sha256 or "")[:8]
     suffix = f"--{sha8}" if sha8 else ""
     pretty = f"{base}{suffix}{ext}"
 
+    create_alias = (os.getenv("MOONDREAM_CREATE_NAMED_ALIAS", "1") or "1") not in ("0", "false", "False")
+    # storage_path: .../data/projects/<projectId>/assets/<sha>.ext
+    named_dir = os.path.join(os.path.dirname(os.path.dirname(job.storage_path)), "named")
+    link_path = os.path.join(named_dir, pretty)
+
+    # Re-queued job with an unchanged caption: the name (and alias) are already in place, so
+    # skip the UPDATE and the named/ scan + symlink churn.
+    if pretty == job.original_name:
+        if not create_alias:
+            return pretty
+        try:
+            if os.readlink(link_path) == job.storage_path:
+                return pretty
+        except OSError:
+            pass
+
     # Update DB display name.
-    con.execute("UPDATE assets SET original_name = ? WHERE id = ?", (pretty, job.asset_id))
+    con.execute(_SQL_RENAME_ASSET, (pretty, job.asset_id))
 
     # Create a friendly alias on disk (symlink) so the user has a readable filename too.
-    if (os.getenv("MOONDREAM_CREATE_NAMED_ALIAS", "1") or "1") in ("0", "false", "False"):
-        return
+    if not create_alias:
+        return pretty
 
     try:
-        # storage_path: .../data/projects/<projectId>/assets/<sha>.ext
-        project_root = os.path.dirname(os.path.dirname(job.storage_path))
-        named_dir = os.path.join(project_root, "named")
         os.makedirs(named_dir, exist_ok=True)
 
-        link_path = os.path.join(named_dir, pretty)
-
         # Best-effort cleanup of prior aliases for this asset (same sha8 + ext).
         if sha8 and ext:
-            for fn in os.listdir(named_dir):
-                if fn.endswith(f"--{sha8}{ext}") and fn != pretty:
-                    try:
-                        os.unlink(os.path.join(named_dir, fn))
-                    except Exception:
-                        pass
+            alias_suffix = f"--{sha8}{ext}"
+            with os.scandir(named_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(alias_suffix) and entry.name != pretty:
+                        try:
+                            os.unlink(entry.path)
+                        except Exception:
+                            pass
 
         if os.path.islink(link_path) or os.path.exists(link_path):
             try:
@@ -1003,237 +1527,522 @@ def maybe_rename_asset(con: sqlite3.Connection, job: Job, caption: str, provider
         os.symlink(job.storage_path, link_path)
     except Exception:
         # Don't fail the whole job on filesystem alias issues.
+        pass
+    return pretty
+
+
+def _get_call_pool() -> Tuple[ThreadPoolExecutor, int]:
+    """Shared pool for a job's detect/segment calls, sized by MOONDREAM_CONCURRENCY."""
+    global _CALL_POOL
+    if _CALL_POOL is not None:
+        return _CALL_POOL
+    with _CALL_POOL_LOCK:
+        if _CALL_POOL is None:
+            # Default 1 (sequential, like MOONDREAM_JOB_CONCURRENCY) so the station's queue
+            # limits hold; raise it only for a station that can take parallel requests.
+            width = max(1, int(os.getenv("MOONDREAM_CONCURRENCY", "1") or "1"))
+            _CALL_POOL = (ThreadPoolExecutor(max_workers=width, thread_name_prefix="moondream-call"), width)
+    return _CALL_POOL
+
+
+def _try_call(fn: Any, *args: Any) -> Tuple[Any, Optional[Exception]]:
+    try:
+        return fn(*args), None
+    except Exception as exc:
+        return None, exc
+
+
+def _is_queue_rejection(exc: Optional[Exception]) -> bool:
+    if not isinstance(exc, ProviderError):
+        return False
+    msg = str(exc).lower()
+    return "queue is full" in msg or "rejected" in msg
+
+
+def _call_many(fn: Any, image_path: str, objs: List[str]) -> List[Tuple[Any, Optional[Exception]]]:
+    if len(objs) == 1:
+        return [_try_call(fn, image_path, objs[0])]
+    pool, _ = _get_call_pool()
+    results = list(pool.map(lambda obj: _try_call(fn, image_path, obj), objs))
+    # The fan-out itself can overrun the station's queue. Re-run the calls it turned away one
+    # at a time (as with MOONDREAM_CONCURRENCY=1) instead of silently dropping their tags.
+    for i, (_, exc) in enumerate(results):
+        if _is_queue_rejection(exc):
+            results[i] = _try_call(fn, image_path, objs[i])
+    return results
+
+
+def _result_cache_path(provider: MoondreamProvider, sha256: str, op: str, arg: str) -> Optional[str]:
+    """
+    File for one cached provider response, or None when MOONDREAM_RESULT_CACHE_DIR is unset.
+    Entries are keyed on the image bytes (sha256), the model and the prompt, so re-queued jobs
+    and duplicate uploads skip the station entirely.
+    """
+    root = os.getenv("MOONDREAM_RESULT_CACHE_DIR", "")
+    if not root or not sha256:
+        return None
+    key = f"{sha256}:{provider.model_version()}:{op}:{arg}".encode("utf-8")
+    digest = hashlib.blake2b(key, digest_size=16).hexdigest()
+    return os.path.join(os.path.expanduser(root), digest[:2], digest + ".json")
+
+
+def _result_cache_get(path: Optional[str]) -> Tuple[bool, Any]:
+    if path is None:
+        return False, None
+    try:
+        with open(path, "rb") as f:
+            return True, _json_loads(f.read())
+    except (OSError, ValueError):
+        return False, None
+
+
+def _result_cache_put(path: Optional[str], value: Any) -> None:
+    if path is None:
         return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(_json_text(value))
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError):
+        pass
 
 
-def main() -> int:
-    db_path = os.getenv("MOONDREAM_DB_PATH", default_db_path())
-    poll = float(os.getenv("MOONDREAM_POLL_SECONDS", "1.0"))
+def _cached_call(provider: MoondreamProvider, sha256: str, op: str, arg: str, fn: Any) -> Any:
+    """fn() behind the on-disk result cache (a plain call when the cache is disabled)."""
+    path = _result_cache_path(provider, sha256, op, arg)
+    hit, value = _result_cache_get(path)
+    if hit:
+        return value
+    value = fn()
+    _result_cache_put(path, value)
+    return value
+
+
+def _cached_many(
+    provider: MoondreamProvider, sha256: str, op: str, args: List[str], fetch: Any
+) -> List[Tuple[Any, Optional[Exception]]]:
+    """fetch(args) -> [(response, error)] behind the on-disk result cache, one entry per arg."""
+    paths = [_result_cache_path(provider, sha256, op, a) for a in args]
+    results: List[Optional[Tuple[Any, Optional[Exception]]]] = []
+    misses: List[int] = []
+    for i, path in enumerate(paths):
+        hit, value = _result_cache_get(path)
+        results.append((value, None) if hit else None)
+        if not hit:
+            misses.append(i)
+    if misses:
+        fetched = fetch([args[i] for i in misses])
+        for i, res in zip(misses, fetched):
+            results[i] = res
+            if res[1] is None:
+                _result_cache_put(paths[i], res[0])
+    return results  # type: ignore[return-value]
+
+
+def _cached_detect_many(
+    provider: MoondreamProvider, sha256: str, image_ref: str, cands: List[str]
+) -> List[Tuple[Any, Optional[Exception]]]:
+    """
+    provider.detect_many, answering (sha256, candidate) pairs seen before from the LRU, then
+    from the on-disk result cache.
+    """
+    results: Dict[str, Tuple[Any, Optional[Exception]]] = {}
+    if sha256:
+        with _DETECT_CACHE_LOCK:
+            for cand in cands:
+                key = (sha256, cand)
+                if key in _DETECT_CACHE:
+                    _DETECT_CACHE.move_to_end(key)
+                    results[cand] = (_DETECT_CACHE[key], None)
+    misses = [c for c in cands if c not in results]
+    if misses:
+        fetched = _cached_many(
+            provider, sha256, "detect", misses, lambda objs: provider.detect_many(image_ref, objs)
+        )
+        for cand, res in zip(misses, fetched):
+            results[cand] = res
+        if sha256:
+            # Only successful responses are cached; errors are retried next time.
+            with _DETECT_CACHE_LOCK:
+                for cand, (resp, exc) in zip(misses, fetched):
+                    if exc is None:
+                        _DETECT_CACHE[(sha256, cand)] = resp
+                while len(_DETECT_CACHE) > _DETECT_CACHE_SIZE:
+                    _DETECT_CACHE.popitem(last=False)
+    return [results[c] for c in cands]
+
+
+def _cached_segment_many(
+    provider: MoondreamProvider, sha256: str, image_ref: str, tags: List[str]
+) -> List[Tuple[Any, Optional[Exception]]]:
+    """provider.segment_many behind the on-disk result cache."""
+    return _cached_many(
+        provider, sha256, "segment", tags, lambda objs: provider.segment_many(image_ref, objs)
+    )
 
-    provider = get_provider()
-    # Helpful diagnostics in logs (especially in desktop builds).
-    if isinstance(provider, LocalStationProvider):
-        print(f"[worker] station_endpoint={provider.endpoint}")
-    print(f"[worker] db={db_path}")
-    print(f"[worker] provider={provider.__class__.__name__} model={provider.model_version()}")
 
-    while True:
-        con = connect(db_path)
+def _segment_unsupported(exc: ProviderError) -> bool:
+    msg = str(exc).lower()
+    return "not available" in msg or "not supported" in msg
+
+
+@dataclass
+class JobResult:
+    caption: str
+    kept_tags: List[str]
+    bbox_by_tag: Dict[str, Any]
+    segments: Dict[str, Optional[str]]
+    emb_model: Optional[str] = None
+    emb_dim: Optional[int] = None
+    emb_blob: Optional[bytes] = None
+
+
+def process_job(provider: MoondreamProvider, job: Job) -> JobResult:
+    """
+    Run every provider call for one asset (caption, candidates, detect, segment, embedding).
+    This never touches the DB, so several jobs can run on pool threads while the main thread
+    keeps the single SQLite connection to itself.
+    """
+    image_ref = provider.prepare_image(job.storage_path)
+
+    # Caption: default to normal for reliability (fewer Station timeouts).
+    # You can override via MOONDREAM_CAPTION_LENGTH=long/short.
+    caption_length = (os.getenv("MOONDREAM_CAPTION_LENGTH", "normal") or "normal").lower()
+    # Provider calls go through the opt-in on-disk result cache (MOONDREAM_RESULT_CACHE_DIR).
+    sha = job.sha256
+    try:
+        caption = _cached_call(
+            provider,
+            sha,
+            "caption",
+            caption_length,
+            lambda: provider.caption(image_ref, length=caption_length),
+        )
+    except ProviderError as exc:
+        msg = str(exc).lower()
+        if caption_length == "long" and any(k in msg for k in ("timeout", "timed out")):
+            caption = _cached_call(
+                provider, sha, "caption", "normal", lambda: provider.caption(image_ref, length="normal")
+            )
+        else:
+            raise
+
+    # Candidate tags are filtered by detect; we only store detect-confirmed tags.
+    max_tags = int(os.getenv("MOONDREAM_SEGMENT_TOP_N", "8"))
+    tags_mode = (os.getenv("MOONDREAM_TAGS_MODE", "hybrid") or "hybrid").lower()
+
+    candidates: List[str] = []
+    if tags_mode in ("query", "hybrid"):
         try:
-            job = fetch_next_job(con)
-            if not job:
-                con.close()
-                time.sleep(poll)
-                continue
+            # Ask for object nouns; we still confirm each with /detect.
+            q = (
+                f"List up to {max_tags * 2} distinct objects visible in this image. "
+                "Respond with ONLY a JSON array. Each item should be a short noun or noun phrase "
+                "(1-2 words), lowercase, with no colors, counts, or adjectives. "
+                'Example: ["person","dog","coffee table"].'
+            )
+            resp = _cached_call(provider, sha, "query", q, lambda: provider.query(image_ref, q))
+            candidates.extend(_parse_object_candidates_from_query_text(resp))
+        except Exception:
+            pass
 
-            print(f"[worker] processing asset={job.asset_id} file={job.original_name}")
-            con.execute("BEGIN")
-            set_status(con, job.asset_id, "processing")
-            con.execute("COMMIT")
+    # Caption fallback (keeps existing behavior and helps when /query fails).
+    if tags_mode in ("caption", "hybrid"):
+        # Caption candidates only fill the slots after the /query ones (or all of them when
+        # /query yielded nothing); repeats are dropped by the set-based dedupe below.
+        candidates.extend(_tokenize_candidates(caption))
+
+    # Probe a few more candidates than we plan to keep, then stop once we have enough.
+    candidates = _dedupe_preserve_order(
+        (_normalize_tag_candidate(c) for c in candidates), limit=max(24, max_tags * 3)
+    )
 
+    kept_tags: List[str] = []
+    bbox_by_tag: Dict[str, Any] = {}
+    # The raw detect response is usually the bulk of bbox_json; MOONDREAM_STORE_RAW_DETECT=0 drops it.
+    keep_raw = (os.getenv("MOONDREAM_STORE_RAW_DETECT", "1") or "1") not in ("0", "false", "False")
+
+    # Detect/segment calls are independent, so run them a window at a time on the call pool.
+    # Results are consumed in candidate order, so the kept tags match a sequential run; at
+    # most one window of extra probes is spent past max_tags.
+    _, width = _get_call_pool()
+    for start in range(0, len(candidates), width):
+        if len(kept_tags) >= max_tags:
+            break
+        window = candidates[start : start + width]
+        probes = _cached_detect_many(provider, sha, image_ref, window)
+        for cand, (detect_resp, _exc) in zip(window, probes):
+            if len(kept_tags) >= max_tags:
+                break
+            if _exc is not None:
+                continue
             try:
-                image_ref = job.storage_path
+                boxes = _extract_detect_boxes(detect_resp)
+            except Exception:
+                continue
+            if not boxes:
+                continue
+            kept_tags.append(cand)
+            bbox_by_tag[cand] = {"tag": cand, "boxes": boxes}
+            if keep_raw:
+                bbox_by_tag[cand]["raw"] = detect_resp
+
+    # Segment the kept tags (best-effort). The first call runs alone so a station without
+    # /segment is detected before fanning out the rest.
+    segments: Dict[str, Optional[str]] = {}
+    segment_supported = True
+    seg_results: List[Tuple[Any, Optional[Exception]]] = []
+    if kept_tags:
+        seg_results.extend(_cached_segment_many(provider, sha, image_ref, kept_tags[:1]))
+        exc = seg_results[0][1]
+        if isinstance(exc, ProviderError) and _segment_unsupported(exc):
+            segment_supported = False
+        elif len(kept_tags) > 1:
+            seg_results.extend(_cached_segment_many(provider, sha, image_ref, kept_tags[1:]))
+    for tag, (seg_resp, exc) in zip(kept_tags, seg_results):
+        if exc is not None:
+            segments[tag] = None
+            continue
+        try:
+            segments[tag] = _extract_segment_svg(seg_resp)
+            seg_bbox = _extract_segment_bbox(seg_resp)
+            if seg_bbox is not None:
+                # Attach segment bbox so the UI can still highlight even if SVG is missing.
+                if tag in bbox_by_tag and isinstance(bbox_by_tag[tag], dict):
+                    bbox_by_tag[tag]["segment_bbox"] = seg_bbox
+        except Exception:
+            segments[tag] = None
+    if not segment_supported:
+        for tag in kept_tags:
+            segments[tag] = None
+
+    # The caption embedding is filled in by main(), batched across the claimed jobs.
+    return JobResult(
+        caption=caption,
+        kept_tags=kept_tags,
+        bbox_by_tag=bbox_by_tag,
+        segments=segments,
+    )
 
-                # Caption: default to normal for reliability (fewer Station timeouts).
-                # You can override via MOONDREAM_CAPTION_LENGTH=long/short.
-                caption_length = (os.getenv("MOONDREAM_CAPTION_LENGTH", "normal") or "normal").lower()
-                try:
-                    caption = provider.caption(image_ref, length=caption_length)
-                except ProviderError as exc:
-                    msg = str(exc).lower()
-                    if caption_length == "long" and any(k in msg for k in ("timeout", "timed out")):
-                        caption = provider.caption(image_ref, length="normal")
-                    else:
-                        raise
-
-                # Candidate tags are filtered by detect; we only store detect-confirmed tags.
-                max_tags = int(os.getenv("MOONDREAM_SEGMENT_TOP_N", "8"))
-                tags_mode = (os.getenv("MOONDREAM_TAGS_MODE", "hybrid") or "hybrid").lower()
-
-                candidates: List[str] = []
-                if tags_mode in ("query", "hybrid"):
-                    try:
-                        # Ask for object nouns; we still confirm each with /detect.
-                        q = (
-                            f"List up to {max_tags * 2} distinct objects visible in this image. "
-                            "Respond with ONLY a JSON array. Each item should be a short noun or noun phrase "
-                            "(1-2 words), lowercase, with no colors, counts, or adjectives. "
-                            'Example: ["person","dog","coffee table"].'
-                        )
-                        resp = provider.query(image_ref, q)
-                        candidates.extend(_parse_object_candidates_from_query_text(resp))
-                    except Exception:
-                        pass
 
-                # Caption fallback (keeps existing behavior and helps when /query fails).
-                if tags_mode in ("caption", "hybrid"):
-                    cap_cands = _tokenize_candidates(caption)
-                    # If /query yielded nothing, use caption candidates; otherwise only use caption
-                    # candidates to fill remaining slots.
-                    if not candidates:
-                        candidates.extend(cap_cands)
-                    else:
-                        candidates.extend([c for c in cap_cands if c not in candidates])
-
-                candidates = _dedupe_preserve_order([_normalize_tag_candidate(c) for c in candidates])
-
-                kept_tags: List[str] = []
-                bbox_by_tag: Dict[str, Any] = {}
-
-                # Probe a few more candidates than we plan to keep, then stop once we have enough.
-                for cand in candidates[: max(24, max_tags * 3)]:
-                    if len(kept_tags) >= max_tags:
-                        break
-                    try:
-                        detect_resp = provider.detect(image_ref, cand)
-                        boxes = _extract_detect_boxes(detect_resp)
-                        if not boxes:
-                            continue
-                        kept_tags.append(cand)
-                        bbox_by_tag[cand] = {
-                            "tag": cand,
-                            "boxes": boxes,
-                            "raw": detect_resp,
-                        }
-                    except Exception:
-                        continue
+def _safe_json(obj: Any) -> Optional[str]:
+    try:
+        return _json_text(obj)
+    except Exception:
+        pass
+    try:
+        # orjson is stricter (e.g. non-str dict keys); give the stdlib a chance.
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    except Exception:
+        return None
 
-                # Segment the kept tags (best-effort).
-                segments: Dict[str, Optional[str]] = {}
-                segment_supported = True
-                for tag in kept_tags:
-                    try:
-                        if not segment_supported:
-                            segments[tag] = None
-                            continue
-                        seg_resp = provider.segment(image_ref, tag)
-                        segments[tag] = _extract_segment_svg(seg_resp)
-                        seg_bbox = _extract_segment_bbox(seg_resp)
-                        if seg_bbox is not None:
-                            # Attach segment bbox so the UI can still highlight even if SVG is missing.
-                            if tag in bbox_by_tag and isinstance(bbox_by_tag[tag], dict):
-                                bbox_by_tag[tag]["segment_bbox"] = seg_bbox
-                    except ProviderError as exc:
-                        msg = str(exc).lower()
-                        if "not available" in msg or "not supported" in msg:
-                            segment_supported = False
-                        segments[tag] = None
-                    except Exception:
-                        segments[tag] = None
-
-                # Compute caption embedding for semantic search (best-effort).
-                emb_model, emb_dim, emb_blob = embed_text_to_f32_blob(caption)
-
-                con.execute("BEGIN")
-                write_results(
-                    con,
-                    job.asset_id,
-                    caption=caption,
-                    tags=kept_tags,
-                    status="done",
-                    model_version=provider.model_version(),
+
+def store_results(con: sqlite3.Connection, job: Job, result: JobResult, provider: MoondreamProvider) -> None:
+    con.execute("BEGIN IMMEDIATE")
+    write_results(
+        con,
+        job.asset_id,
+        caption=result.caption,
+        tags=result.kept_tags,
+        status="done",
+        model_version=provider.model_version(),
+    )
+
+    # Generate a nicer filename + create a named alias file (best-effort).
+    display_name = maybe_rename_asset(con, job, caption=result.caption, provider=provider)
+
+    if result.emb_model and result.emb_dim and result.emb_blob:
+        upsert_embedding_row(
+            con,
+            asset_id=job.asset_id,
+            model=result.emb_model,
+            dim=result.emb_dim,
+            embedding_blob=result.emb_blob,
+        )
+        if (os.getenv("MOONDREAM_EMBED_CACHE", "0") or "0").lower() in ("1", "true", "yes"):
+            try:
+                con.execute(
+                    _SQL_INSERT_TEXT_EMBED,
+                    (_text_embed_key(result.caption), result.emb_model, result.emb_dim, result.emb_blob),
                 )
+            except sqlite3.OperationalError:
+                # Missing cache table; the job's own results still get stored.
+                pass
 
-                # Generate a nicer filename + create a named alias file (best-effort).
-                maybe_rename_asset(con, job, caption=caption, provider=provider)
+    # Store per-tag segment + bbox payloads for highlight overlays.
+    upsert_segment_rows(
+        con,
+        job.asset_id,
+        [
+            (tag, result.segments.get(tag), _safe_json(result.bbox_by_tag.get(tag)))
+            for tag in result.kept_tags
+        ],
+    )
+    delete_segments_not_in(con, job.asset_id, result.kept_tags)
+
+    update_search_index(
+        con,
+        job.asset_id,
+        job.project_id,
+        display_name or job.original_name,
+        caption=result.caption,
+        tags_text=" ".join(t for t in result.kept_tags if t),
+    )
+    con.execute("COMMIT")
 
-                if emb_model and emb_dim and emb_blob:
-                    upsert_embedding_row(
-                        con,
-                        asset_id=job.asset_id,
-                        model=emb_model,
-                        dim=emb_dim,
-                        embedding_blob=emb_blob,
-                    )
 
-                # Store per-tag segment + bbox payloads for highlight overlays.
-                for tag in kept_tags:
-                    bbox_json = None
-                    try:
-                        bbox_json = json.dumps(bbox_by_tag.get(tag))
-                    except Exception:
-                        bbox_json = None
-                    upsert_segment_row(
-                        con,
-                        asset_id=job.asset_id,
-                        tag=tag,
-                        svg=segments.get(tag),
-                        bbox_json=bbox_json,
-                    )
-                delete_segments_not_in(con, job.asset_id, kept_tags)
+def record_failure(con: sqlite3.Connection, job: Job, exc: Exception, provider: MoondreamProvider) -> None:
+    if not isinstance(exc, ProviderError):
+        reset_results(con, job, "failed", provider.model_version())
+        print(f"[worker] failed asset={job.asset_id}: {exc}")
+        return
 
-                update_search_index(con, job.asset_id)
-                con.execute("COMMIT")
-                print(f"[worker] done asset={job.asset_id}")
-            except ProviderError as exc:
-                # Treat station-side queue/timeouts as transient; re-queue with a small backoff.
-                msg = str(exc).lower()
-                transient = any(
-                    k in msg
-                    for k in (
-                        "queue is full",
-                        "rejected",
-                        "timeout",
-                        "timed out",
-                        # Local Station not running / network hiccups should NOT mark the asset failed.
-                        "connection refused",
-                        "failed to establish a new connection",
-                        "max retries exceeded",
-                        "connection error",
-                    )
-                )
-                con.execute("BEGIN")
-                if transient:
-                    # Re-queue without poisoning the caption field.
-                    write_results(
-                        con,
-                        job.asset_id,
-                        caption="",
-                        tags=[],
-                        status="pending",
-                        model_version=provider.model_version(),
-                    )
-                    delete_segments_not_in(con, job.asset_id, [])
-                    update_search_index(con, job.asset_id)
-                    con.execute("COMMIT")
-                    sleep_s = float(os.getenv("MOONDREAM_RETRY_BACKOFF_SECONDS", "5.0"))
-                    print(f"[worker] transient error; re-queued asset={job.asset_id}: {exc} (sleep {sleep_s}s)")
-                    time.sleep(sleep_s)
-                else:
-                    write_results(
-                        con,
-                        job.asset_id,
-                        caption="",
-                        tags=[],
-                        status="failed",
-                        model_version=provider.model_version(),
-                    )
-                    delete_segments_not_in(con, job.asset_id, [])
-                    update_search_index(con, job.asset_id)
-                    con.execute("COMMIT")
-                    print(f"[worker] failed asset={job.asset_id}: {exc}")
-            except Exception as exc:
-                con.execute("BEGIN")
-                write_results(
-                    con,
-                    job.asset_id,
-                    caption="",
-                    tags=[],
-                    status="failed",
-                    model_version=provider.model_version(),
-                )
-                delete_segments_not_in(con, job.asset_id, [])
-                update_search_index(con, job.asset_id)
-                con.execute("COMMIT")
-                print(f"[worker] failed asset={job.asset_id}: {exc}")
-        finally:
+    # Treat station-side queue/timeouts as transient; re-queue with a small backoff.
+    msg = str(exc).lower()
+    transient = any(
+        k in msg
+        for k in (
+            "queue is full",
+            "rejected",
+            "timeout",
+            "timed out",
+            # Local Station not running / network hiccups should NOT mark the asset failed.
+            "connection refused",
+            "failed to establish a new connection",
+            "max retries exceeded",
+            "connection error",
+        )
+    )
+    if transient:
+        # Re-queue without poisoning the caption field.
+        reset_results(con, job, "pending", provider.model_version())
+        sleep_s = float(os.getenv("MOONDREAM_RETRY_BACKOFF_SECONDS", "5.0"))
+        print(f"[worker] transient error; re-queued asset={job.asset_id}: {exc} (sleep {sleep_s}s)")
+        time.sleep(sleep_s)
+    else:
+        reset_results(con, job, "failed", provider.model_version())
+        print(f"[worker] failed asset={job.asset_id}: {exc}")
+
+
+def claim_jobs(con: sqlite3.Connection, limit: int) -> List[Job]:
+    jobs: List[Job] = []
+    while len(jobs) < limit:
+        job = claim_next_job(con)
+        # Guard against a lease shorter than the claim loop itself handing back a job that is
+        # already in this batch.
+        if not job or any(j.asset_id == job.asset_id for j in jobs):
+            break
+        jobs.append(job)
+    return jobs
+
+
+def process_batch(
+    con: sqlite3.Connection,
+    provider: MoondreamProvider,
+    pool: ThreadPoolExecutor,
+    concurrency: int,
+    poll: float,
+) -> None:
+    """Claim up to `concurrency` jobs, run them on the pool and store the outcomes."""
+    jobs = claim_jobs(con, concurrency)
+    if not jobs:
+        time.sleep(poll)
+        return
+
+    futures = []
+    for job in jobs:
+        print(f"[worker] processing asset={job.asset_id} file={job.original_name}")
+        futures.append(pool.submit(process_job, provider, job))
+
+    outcomes: List[Tuple[Job, Optional[JobResult], Optional[Exception]]] = []
+    for job, future in zip(jobs, futures):
+        try:
+            outcomes.append((job, future.result(), None))
+        except Exception as exc:
+            outcomes.append((job, None, exc))
+
+    # Caption embeddings for the whole batch in one encode call (best-effort). The batch is the
+    # set of claimed jobs, so encodes only batch with MOONDREAM_JOB_CONCURRENCY > 1; holding
+    # finished jobs back to fill a bigger batch would delay their results.
+    finished = [result for _, result, _ in outcomes if result is not None]
+    emb_model, emb_dim, emb_blobs = embed_texts_cached(con, [r.caption for r in finished])
+    for result, emb_blob in zip(finished, emb_blobs):
+        result.emb_model, result.emb_dim, result.emb_blob = emb_model, emb_dim, emb_blob
+
+    for job, result, error in outcomes:
+        try:
+            if error is not None:
+                raise error
+            store_results(con, job, result, provider)
+            print(f"[worker] done asset={job.asset_id}")
+        except Exception as exc:
+            record_failure(con, job, exc, provider)
+
+
+def main() -> int:
+    db_path = os.getenv("MOONDREAM_DB_PATH", default_db_path())
+    poll = float(os.getenv("MOONDREAM_POLL_SECONDS", "1.0"))
+
+    provider = get_provider()
+    # Helpful diagnostics in logs (especially in desktop builds).
+    if isinstance(provider, LocalStationProvider):
+        print(f"[worker] station_endpoint={provider.endpoint}")
+    print(f"[worker] db={db_path}")
+    print(f"[worker] provider={provider.__class__.__name__} model={provider.model_version()}")
+
+    # Load the embedding model up front rather than stalling the first job on it.
+    _get_embedder()
+
+    # Jobs run their (slow, I/O-bound) provider calls concurrently on a pool; all SQLite work
+    # stays on this thread. The default of 1 keeps the previous one-at-a-time behavior.
+    concurrency = max(1, int(os.getenv("MOONDREAM_JOB_CONCURRENCY", "1") or "1"))
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+
+    # One connection for the worker's lifetime; reopening per poll throws away the page cache.
+    con = connect(db_path)
+    ensure_schema(con)
+    next_optimize = time.monotonic() + _OPTIMIZE_INTERVAL_SECONDS
+    reconnects = 0
+    try:
+        while True:
             try:
-                con.close()
-            except Exception:
-                pass
+                process_batch(con, provider, pool, concurrency, poll)
+                reconnects = 0
+                if time.monotonic() >= next_optimize:
+                    # Long-lived connection: refresh query-planner stats now and then.
+                    con.execute("PRAGMA optimize")
+                    next_optimize = time.monotonic() + _OPTIMIZE_INTERVAL_SECONDS
+            except sqlite3.OperationalError as exc:
+                # e.g. the DB file was replaced underneath us; reopen and carry on. Claimed
+                # jobs stay 'processing' and are picked up again once their lease expires.
+                # Anything else (or an error that survives reconnecting) is persistent: re-raise
+                # rather than re-running paid inference on the same jobs forever.
+                msg = str(exc).lower()
+                reconnects += 1
+                if not any(k in msg for k in _RECONNECT_ERRORS):
+                    raise
+                if reconnects > _MAX_CONSECUTIVE_RECONNECTS:
+                    print(f"[worker] sqlite error persists after {_MAX_CONSECUTIVE_RECONNECTS} reconnects")
+                    raise
+                print(f"[worker] sqlite error, reconnecting: {exc}")
+                try:
+                    con.close()
+                except Exception:
+                    pass
+                time.sleep(poll)
+                con = connect(db_path)
+                # A replaced DB may predate the worker's own tables.
+                ensure_schema(con)
+    finally:
+        pool.shutdown(wait=False)
+        try:
+            con.execute("PRAGMA optimize")
+            con.close()
+        except Exception:
+            pass
 
 
 if __name__ == "__main__":
     raise SystemExit(main())
-
-